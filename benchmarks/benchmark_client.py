@@ -0,0 +1,196 @@
+'''
+Benchmarks the ModularClient request and response hot path against simulated
+modular devices, so performance regressions can be caught without hardware.
+Reports per call latency percentiles and calls per second for request encoding,
+response handling and complete round trips, construction time against method
+count and discovery time against port count. Requires a POSIX system with
+pseudo terminal support, like Linux.
+
+Usage:
+
+python -m benchmarks.benchmark_client
+python -m benchmarks.benchmark_client --quick --json results.json
+# exit with status 1 if any median latency is more than 50% slower than a
+# baseline or any request count grew
+python -m benchmarks.benchmark_client --baseline results.json --tolerance 0.5
+'''
+import argparse
+import json
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+import modular_client.modular_client as modular_client_module
+from modular_client import ModularClient, find_modular_device_ports
+
+from .fake_modular_device import FakeModularDevice
+
+
+PERCENTILES = [50,90,99]
+
+def percentile(sorted_samples,percent):
+    index = int(round((percent/100.0)*(len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+def summarize(samples):
+    '''
+    Returns latency percentiles in microseconds and calls per second.
+    '''
+    sorted_samples = sorted(samples)
+    summary = {}
+    for percent in PERCENTILES:
+        summary['p{0}_us'.format(percent)] = percentile(sorted_samples,percent)*1e6
+    summary['calls_per_s'] = len(samples)/sum(samples)
+    return summary
+
+def time_calls(func,count):
+    samples = []
+    for call_index in range(count):
+        time_start = timer()
+        func()
+        samples.append(timer() - time_start)
+    return samples
+
+def benchmark_hot_path(call_count):
+    results = {}
+    fake_dev = FakeModularDevice()
+    try:
+        dev = ModularClient(port=fake_dev.port,use_cache=False)
+        method_id = dev._method_dict['add']
+        response = json.dumps({'id': method_id,'result': 3},separators=(',',':'))
+        results['args_to_request'] = summarize(time_calls(lambda: dev._args_to_request(method_id,1,2),call_count))
+        results['handle_response'] = summarize(time_calls(lambda: dev._handle_response(response,method_id),call_count))
+        results['send_request_get_result'] = summarize(time_calls(lambda: dev._send_request_get_result(method_id,1,2),call_count))
+        results['method_call'] = summarize(time_calls(lambda: dev.add(1,2),call_count))
+        results['call_get_result'] = summarize(time_calls(lambda: dev.call_get_result('add',1,2),call_count))
+        calls = [('add',1,2)]*call_count
+        time_start = timer()
+        dev.call_many(calls)
+        results['call_many'] = {'calls_per_s': call_count/(timer() - time_start)}
+        dev.close()
+    finally:
+        fake_dev.close()
+    return results
+
+def benchmark_construction(method_counts):
+    results = {}
+    cache_dir = tempfile.mkdtemp()
+    for method_count in method_counts:
+        fake_dev = FakeModularDevice(method_count=method_count)
+        try:
+            for cache_state in ['uncached','cold_cache','warm_cache','lazy']:
+                kwargs = {'port': fake_dev.port,'cache_dir': cache_dir}
+                if cache_state == 'uncached':
+                    kwargs['use_cache'] = False
+                elif cache_state == 'lazy':
+                    kwargs['use_cache'] = False
+                    kwargs['lazy'] = True
+                request_count = fake_dev.request_count
+                time_start = timer()
+                dev = ModularClient(**kwargs)
+                construction_time = timer() - time_start
+                dev.close()
+                key = '{0}_methods_{1}'.format(method_count,cache_state)
+                results[key] = {'time_s': construction_time,
+                                'requests': fake_dev.request_count - request_count}
+        finally:
+            fake_dev.close()
+    modular_client_module.clear_cache(cache_dir)
+    return results
+
+def benchmark_discovery(port_counts):
+    results = {}
+    find_serial_interface_ports = modular_client_module.find_serial_interface_ports
+    try:
+        for port_count in port_counts:
+            fake_devs = [FakeModularDevice(serial_number=serial_number) for serial_number in range(port_count)]
+            ports = [fake_dev.port for fake_dev in fake_devs]
+            # pseudo terminals are not listed as serial ports, so hand them to
+            # discovery directly
+            modular_client_module.find_serial_interface_ports = lambda try_ports=None,debug=False: list(ports)
+            try:
+                for mode,max_workers in [('sequential',1),('concurrent',None)]:
+                    time_start = timer()
+                    modular_device_ports = find_modular_device_ports(max_workers=max_workers)
+                    discovery_time = timer() - time_start
+                    if len(modular_device_ports) != port_count:
+                        raise RuntimeError('Discovered {0} of {1} fake devices'.format(len(modular_device_ports),port_count))
+                    results['{0}_ports_{1}'.format(port_count,mode)] = {'time_s': discovery_time}
+            finally:
+                for fake_dev in fake_devs:
+                    fake_dev.close()
+    finally:
+        modular_client_module.find_serial_interface_ports = find_serial_interface_ports
+    return results
+
+def compare_to_baseline(results,baseline,tolerance):
+    '''
+    Returns a list of descriptions of every median latency or time in results
+    that is more than tolerance slower than the same measurement in baseline,
+    and of every request count that grew. Tail percentiles are too noisy on
+    shared machines to compare.
+    '''
+    regressions = []
+    for group,measurements in results.items():
+        for name,values in measurements.items():
+            for value_name,value in values.items():
+                try:
+                    baseline_value = baseline[group][name][value_name]
+                except KeyError:
+                    continue
+                if value_name in ['p50_us','time_s']:
+                    regressed = value > baseline_value*(1 + tolerance)
+                elif value_name == 'requests':
+                    regressed = value > baseline_value
+                else:
+                    regressed = False
+                if regressed:
+                    regressions.append('{0} {1} {2}: {3:.6g} > baseline {4:.6g}'.format(group,name,value_name,value,baseline_value))
+    return regressions
+
+def print_results(results):
+    for group,measurements in results.items():
+        print(group)
+        for name,values in measurements.items():
+            values_string = ', '.join(['{0}={1:.6g}'.format(value_name,value) for value_name,value in values.items()])
+            print('  {0}: {1}'.format(name,values_string))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ModularClient against simulated modular devices.')
+    parser.add_argument('--quick',action='store_true',help='run fewer calls, method counts and port counts')
+    parser.add_argument('--json',help='save results to a json file')
+    parser.add_argument('--baseline',help='json results file to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.5,help='allowed fractional slowdown against the baseline')
+    args = parser.parse_args()
+
+    if args.quick:
+        call_count = 200
+        method_counts = [10,100]
+        port_counts = [1,4]
+    else:
+        call_count = 2000
+        method_counts = [10,50,100,200]
+        port_counts = [1,2,4,8,16]
+
+    results = {}
+    results['hot_path'] = benchmark_hot_path(call_count)
+    results['construction'] = benchmark_construction(method_counts)
+    results['discovery'] = benchmark_discovery(port_counts)
+    print_results(results)
+
+    if args.json is not None:
+        with open(args.json,'w') as results_file:
+            json.dump(results,results_file,indent=2)
+    if args.baseline is not None:
+        with open(args.baseline,'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(results,baseline,args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
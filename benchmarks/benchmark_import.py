@@ -0,0 +1,71 @@
+'''
+Measures how long importing modular_client takes in a fresh interpreter, as it
+does at the start of every short lived script, and checks that slow modules
+only needed by some features are not imported until they are used.
+
+Usage:
+
+python -m benchmarks.benchmark_import
+# exit with status 1 if the median import time is more than 100 ms or any
+# deferred module is imported along with modular_client
+python -m benchmarks.benchmark_import --max-ms 100
+'''
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+DEFERRED_MODULES = ['pkg_resources','importlib.metadata','asyncio','inflection','sre_yield','serial_interface']
+
+IMPORT_SCRIPT = '''
+import json
+import sys
+from timeit import default_timer as timer
+time_start = timer()
+import modular_client
+import_time = timer() - time_start
+print(json.dumps({'import_time_s': import_time,'modules': sorted(sys.modules.keys())}))
+'''
+
+def measure_import():
+    '''
+    Returns the import time in seconds and the names of all modules imported
+    by a fresh interpreter that imports modular_client.
+    '''
+    output = subprocess.run([sys.executable,'-c',IMPORT_SCRIPT],
+                            check=True,
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    result = json.loads(output)
+    return result['import_time_s'],result['modules']
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the time it takes to import modular_client.')
+    parser.add_argument('--repeat',type=int,default=10,help='number of fresh interpreters to time')
+    parser.add_argument('--max-ms',type=float,help='maximum allowed median import time in milliseconds')
+    args = parser.parse_args()
+
+    # the first import may compile and cache bytecode, so it is not timed
+    measure_import()
+    import_times = []
+    for repeat_index in range(args.repeat):
+        import_time,modules = measure_import()
+        import_times.append(import_time)
+    median_ms = statistics.median(import_times)*1e3
+    print('import modular_client: median={0:.1f} ms, min={1:.1f} ms'.format(median_ms,min(import_times)*1e3))
+    deferred_modules_imported = [module for module in DEFERRED_MODULES if module in modules]
+    print('deferred modules imported: {0}'.format(', '.join(deferred_modules_imported) or 'none'))
+
+    failed = len(deferred_modules_imported) > 0
+    if (args.max_ms is not None) and (median_ms > args.max_ms):
+        print('REGRESSION median import time {0:.1f} ms > {1:.1f} ms'.format(median_ms,args.max_ms))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
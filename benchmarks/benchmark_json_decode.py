@@ -0,0 +1,60 @@
+'''
+Compares the single pass response decoding used by json_string_to_dict with
+the previous json_decode_dict object hook on representative server responses.
+
+Usage:
+
+python -m benchmarks.benchmark_json_decode
+'''
+import json
+import timeit
+
+from modular_client.modular_client import json_string_to_dict, json_decode_dict
+
+
+def object_hook_decode(json_string):
+    return json.loads(json_string,object_hook=json_decode_dict)
+
+def create_api_response(function_count=150):
+    functions = []
+    for function_index in range(function_count):
+        functions.append({'name': 'function{0}'.format(function_index),
+                          'firmware': 'ModularServer',
+                          'parameters': [{'name': 'parameter{0}'.format(parameter_index),
+                                          'type': 'long',
+                                          'units': 'ms',
+                                          'min': 0,
+                                          'max': 1000,
+                                          'array_element_type': 'long',
+                                          'array_length_range': [1,8]}
+                                         for parameter_index in range(3)],
+                          'result_info': {'type': 'array','array_element_type': 'long'}})
+    result = {'firmware': ['ModularServer'],
+              'verbosity': 'DETAILED',
+              'functions': functions,
+              'parameters': [],
+              'properties': [{'name': 'property{0}'.format(i),'value': list(range(8))} for i in range(50)],
+              'callbacks': []}
+    return json.dumps({'id': 'getApi','result': result},separators=(',',':'))
+
+def create_array_response(length=10000):
+    return json.dumps({'id': 12,'result': list(range(length))},separators=(',',':'))
+
+def create_small_response():
+    return json.dumps({'id': 3,'result': {'name': 'device','form_factor': '5x3','serial_number': 0}},separators=(',',':'))
+
+def main():
+    responses = [('small',create_small_response(),20000),
+                 ('array',create_array_response(),200),
+                 ('get_api',create_api_response(),200)]
+    print('{0:<10}{1:>16}{2:>16}{3:>10}'.format('response','object_hook us','single_pass us','speedup'))
+    for name,response,number in responses:
+        assert object_hook_decode(response) == json_string_to_dict(response)
+        object_hook_time = min(timeit.repeat(lambda: object_hook_decode(response),number=number,repeat=5))/number
+        single_pass_time = min(timeit.repeat(lambda: json_string_to_dict(response),number=number,repeat=5))/number
+        print('{0:<10}{1:>16.2f}{2:>16.2f}{3:>9.1f}x'.format(name,object_hook_time*1e6,single_pass_time*1e6,object_hook_time/single_pass_time))
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+'''
+Compares the per call CPU time of the generic request path, which encodes the
+method id and arguments with json.dumps on every call, with the precompiled
+request encoders attached to each method. The serial write and read are
+replaced with a no-op so only the Python overhead of a call is measured.
+Requires a POSIX system with pseudo terminal support, like Linux.
+
+Usage:
+
+python -m benchmarks.benchmark_request_encoding
+'''
+import json
+import timeit
+
+from modular_client import ModularClient
+
+from .fake_modular_device import FakeModularDevice
+
+
+def json_dumps_request(method_id,*args):
+    request = json.dumps((method_id,) + args,separators=(',',':'))
+    request += '\n'
+    return request.encode()
+
+def main():
+    fake_dev = FakeModularDevice()
+    try:
+        dev = ModularClient(port=fake_dev.port,use_cache=False,lazy=True)
+        method_id = dev._method_dict['add']
+        assert dev.add._encode_request((1,2)) == json_dumps_request(method_id,1,2)
+        dev._send_request = lambda request,request_id,method_id,time_start=None: None
+        number = 100000
+        benchmarks = [('encode json.dumps',lambda: json_dumps_request(method_id,1,2)),
+                      ('encode precompiled',lambda: dev.add._encode_request((1,2))),
+                      ('call generic path',lambda: dev._send_request_by_method_id(method_id,1,2)),
+                      ('call precompiled',lambda: dev.add(1,2))]
+        times = {}
+        for name,func in benchmarks:
+            times[name] = min(timeit.repeat(func,number=number,repeat=5))/number
+            print('{0:<20}{1:>10.3f} us'.format(name,times[name]*1e6))
+        print('encode speedup {0:.1f}x'.format(times['encode json.dumps']/times['encode precompiled']))
+        print('call speedup {0:.1f}x'.format(times['call generic path']/times['call precompiled']))
+        dev.close()
+    finally:
+        fake_dev.close()
+
+
+# -----------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main()
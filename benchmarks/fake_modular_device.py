@@ -0,0 +1,165 @@
+'''
+Simulated modular device for benchmarking ModularClient without hardware. Each
+FakeModularDevice opens a pseudo terminal and answers requests written to it
+with the same newline delimited json protocol as a modular device server, so a
+ModularClient can connect to FakeModularDevice.port like a real serial port.
+Requires a POSIX system with pseudo terminal support, like Linux.
+
+Example Usage:
+
+from modular_client import ModularClient
+from benchmarks.fake_modular_device import FakeModularDevice
+fake_dev = FakeModularDevice(method_count=100)
+dev = ModularClient(port=fake_dev.port)
+dev.add(1,2)
+dev.close()
+fake_dev.close()
+'''
+import json
+import os
+import select
+import threading
+import time
+import tty
+
+
+class FakeModularDevice(object):
+    '''FakeModularDevice serves a fixed set of methods, getMethodIds, getDeviceId,
+    getDeviceInfo, getApi, getValue, setValue, add, echo and getArray, plus
+    method_count dummy methods, on a pseudo terminal. processing_delay seconds
+    are spent handling each request to emulate slower firmware.
+    '''
+    _READ_SIZE = 4096
+    _SELECT_TIMEOUT = 0.05
+    _FIRMWARE_NAME = 'FakeFirmware'
+    _PARSE_ERROR_CODE = -32700
+    _METHOD_NOT_FOUND_CODE = -32601
+    _INVALID_PARAMS_CODE = -32602
+
+    def __init__(self,
+                 method_count=10,
+                 name='fake_device',
+                 form_factor='5x3',
+                 serial_number=0,
+                 firmware_version='1.0.0',
+                 processing_delay=0.0):
+        self.name = name
+        self.form_factor = form_factor
+        self.serial_number = serial_number
+        self.firmware_version = firmware_version
+        self.processing_delay = processing_delay
+        self.request_count = 0
+        self._values = {}
+        self._methods = {}
+        self._add_method('getMethodIds',[])
+        self._add_method('getDeviceId',[])
+        self._add_method('getDeviceInfo',[])
+        self._add_method('getApi',['verbosity','firmware'])
+        self._add_method('getValue',['key'])
+        self._add_method('setValue',['key','value'])
+        self._add_method('add',['a','b'])
+        self._add_method('echo',['data'])
+        self._add_method('getArray',['count'])
+        for method_index in range(method_count):
+            self._add_method('getDummy{0}'.format(method_index),[])
+        self._methods_by_id = dict((method_id,method_name) for (method_name,(method_id,_)) in self._methods.items())
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port = os.ttyname(self._slave_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve,daemon=True)
+        self._thread.start()
+
+    def _add_method(self,method_name,parameter_names):
+        method_id = len(self._methods)
+        self._methods[method_name] = (method_id,parameter_names)
+
+    def close(self):
+        '''
+        Stop serving requests and close the pseudo terminal.
+        '''
+        self._running = False
+        self._thread.join()
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def _serve(self):
+        read_buffer = b''
+        while self._running:
+            readable, _, _ = select.select([self._master_fd],[],[],self._SELECT_TIMEOUT)
+            if not readable:
+                continue
+            try:
+                read_buffer += os.read(self._master_fd,self._READ_SIZE)
+            except OSError:
+                break
+            while b'\n' in read_buffer:
+                request, read_buffer = read_buffer.split(b'\n',1)
+                response = self._handle_request(request)
+                if self.processing_delay:
+                    time.sleep(self.processing_delay)
+                response = (json.dumps(response,separators=(',',':')) + '\n').encode()
+                while response:
+                    bytes_written = os.write(self._master_fd,response)
+                    response = response[bytes_written:]
+
+    def _handle_request(self,request):
+        self.request_count += 1
+        try:
+            request = json.loads(request)
+        except ValueError:
+            return {'id': None,'error': {'message': 'Parse error','code': self._PARSE_ERROR_CODE}}
+        if isinstance(request,dict):
+            request_id = request.get('id')
+            method = request.get('method')
+            params = request.get('params',[])
+        else:
+            request_id = request[0]
+            method = request[0]
+            params = request[1:]
+        method_name = self._methods_by_id.get(method,method)
+        if method_name not in self._methods:
+            return {'id': request_id,'error': {'message': 'Method not found','code': self._METHOD_NOT_FOUND_CODE}}
+        method_id, parameter_names = self._methods[method_name]
+        if params == ['??']:
+            return {'id': request_id,'result': self._get_method_help(method_name)}
+        if len(params) != len(parameter_names):
+            data = 'Incorrect number of parameters. {0} given. {1} needed.'.format(len(params),len(parameter_names))
+            return {'id': request_id,'error': {'message': 'Invalid params','data': data,'code': self._INVALID_PARAMS_CODE}}
+        return {'id': request_id,'result': self._call_method(method_name,params)}
+
+    def _get_method_help(self,method_name):
+        method_id, parameter_names = self._methods[method_name]
+        return {'name': method_name,
+                'firmware': self._FIRMWARE_NAME,
+                'parameters': [{'name': parameter_name,'type': 'any'} for parameter_name in parameter_names],
+                'result_info': {'type': 'any'}}
+
+    def _call_method(self,method_name,params):
+        if method_name == 'getMethodIds':
+            return dict((name,method_id) for (name,(method_id,_)) in self._methods.items())
+        elif method_name == 'getDeviceId':
+            return {'name': self.name,'form_factor': self.form_factor,'serial_number': self.serial_number}
+        elif method_name == 'getDeviceInfo':
+            return {'processor': 'fake',
+                    'hardware': [],
+                    'firmware': [{'name': self._FIRMWARE_NAME,'version': self.firmware_version}]}
+        elif method_name == 'getApi':
+            return {'firmware': [self._FIRMWARE_NAME],
+                    'verbosity': params[0],
+                    'functions': [self._get_method_help(name) for name in sorted(self._methods)],
+                    'parameters': [],
+                    'properties': [],
+                    'callbacks': []}
+        elif method_name == 'getValue':
+            return self._values.get(params[0])
+        elif method_name == 'setValue':
+            self._values[params[0]] = params[1]
+            return None
+        elif method_name == 'add':
+            return params[0] + params[1]
+        elif method_name == 'echo':
+            return params[0]
+        elif method_name == 'getArray':
+            return list(range(params[0]))
+        return 0
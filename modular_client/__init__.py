@@ -6,4 +6,17 @@ Windows, and Mac OS X. This class automatically creates methods from
 available functions reported by the modular device when it is running the
 appropriate firmware.
 '''
-from .modular_client import ModularClient, ModularClients, find_modular_device_ports, find_modular_device_port, __version__
+from .modular_client import ModularClient, ModularClients, find_modular_device_ports, find_modular_device_port, clear_cache, save_api_stub
+from .modular_client import ModularClientError, DeviceError, ResponseTimeoutError, ProtocolError, RetryPolicy
+
+
+def __getattr__(name):
+    # asyncio and the version lookup are slow to import, so they are deferred
+    # until first use
+    if name == '__version__':
+        from .modular_client import __version__
+        return __version__
+    if name == 'AsyncModularClient':
+        from .async_modular_client import AsyncModularClient
+        return AsyncModularClient
+    raise AttributeError('module {0} has no attribute {1}'.format(__name__,name))
@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import os
+import time
+
+from .modular_client import ModularClient
+
+
+class AsyncModularClient(object):
+    '''AsyncModularClient wraps a ModularClient and exposes the methods reported
+    by the modular device as coroutines. Requests are written and responses are
+    read without blocking the event loop, so one event loop can drive many
+    devices concurrently. Requests to the same device are serialized by a
+    per-device lock and take turns with requests made through the wrapped
+    ModularClient from other threads.
+
+    Example Usage:
+
+    import asyncio
+    from modular_client import AsyncModularClient
+
+    async def main():
+        dev = await AsyncModularClient.create(port='/dev/ttyACM0')
+        device_id = await dev.get_device_id()
+        dev.close()
+
+    asyncio.run(main())
+    '''
+    def __init__(self,client):
+        self._client = client
+        self._lock = asyncio.Lock()
+        self._read_buffer = bytearray()
+        for method_name, method_id in sorted(client._method_dict.items()):
+            setattr(self,method_name,self._create_method(method_name,method_id))
+
+    @classmethod
+    async def create(cls,*args,**kwargs):
+        '''
+        Constructs a ModularClient in an executor thread, so discovery and the
+        method handshake do not block the event loop, and wraps it. Accepts the
+        same arguments as ModularClient.
+        '''
+        loop = asyncio.get_running_loop()
+        client = await loop.run_in_executor(None,functools.partial(ModularClient,*args,**kwargs))
+        return cls(client)
+
+    def _create_method(self,method_name,method_id):
+        async def method_func(*args,**kwargs):
+            if kwargs or ((len(args) == 1) and (type(args[0]) is dict)):
+                args = await self._args_to_list(method_name,method_id,args,kwargs)
+            return await self._send_request_get_result(method_id,*args)
+        method_func.__name__ = method_name
+        if not self._client._lazy:
+            method_func.__doc__ = getattr(self._client,method_name).__doc__
+        elif method_name in self._client._method_help_dict:
+            method_func.__doc__ = str(self._client._method_help_dict[method_name])
+        return method_func
+
+    async def _args_to_list(self,method_name,method_id,args,kwargs):
+        if not kwargs:
+            args, kwargs = (), args[0]
+        client = self._client
+        if method_name not in client._method_help_dict:
+            # the parameter names are requested from the device the first
+            # time, taking turns with the other requests
+            method_help = await self._send_request_get_result(method_id,client._VERBOSE_HELP_STRING)
+            client._method_help_dict.setdefault(method_name,method_help)
+        return client._args_to_list(method_name,method_id,args,kwargs)
+
+    async def _send_request_get_result(self,*args):
+        '''
+        Sends request to server over serial port and
+        returns response result
+        '''
+        fd = None
+        if not self._client._unique_ids:
+            request = self._client._args_to_request(*args)
+            async with self._lock:
+                await self._acquire_request_turn()
+                try:
+                    # a reconnect replaces the serial interface, so its file
+                    # descriptor is looked up on every turn
+                    serial_interface = self._client._serial_interface
+                    fd = self._get_fd(serial_interface)
+                    if fd is not None:
+                        response_timeout = serial_interface.timeout * self._client._MAX_READ_ATTEMPTS
+                        self._client._debug_print('request', request)
+                        await self._write(fd,request.encode(),response_timeout)
+                        response = await self._readline(fd,response_timeout)
+                finally:
+                    self._client._request_lock.release()
+        if fd is None:
+            # the client serializes requests from executor threads itself
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None,functools.partial(self._client._send_request_get_result,*args))
+        self._client._debug_print('response', response)
+        return self._client._handle_response(response,args[0])
+
+    def _get_fd(self,serial_interface):
+        '''
+        Returns the file descriptor of the serial port, or None if requests
+        must be sent by the client in an executor thread.
+        '''
+        try:
+            return serial_interface.fileno()
+        except (AttributeError,NotImplementedError,IOError):
+            # serial ports without file descriptors, like on Windows, and
+            # closed ports, which the client may reconnect, fall back to
+            # blocking requests
+            return None
+
+    async def _acquire_request_turn(self):
+        '''
+        Waits for a turn to use the serial port in the same queue as requests
+        made through the wrapped client from other threads. The turn is owned
+        by this object rather than by a thread, so the event loop thread can
+        release it.
+        '''
+        request_lock = self._client._request_lock
+        if request_lock.acquire(0,self):
+            return
+        timeout = self._client._request_timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None,functools.partial(request_lock.acquire,timeout,self))
+        try:
+            acquired = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # give the turn back once the executor thread gets it
+            future.add_done_callback(lambda future: future.result() and request_lock.release())
+            raise
+        if not acquired:
+            raise TimeoutError('Timed out after {0}s waiting for serial port {1}'.format(timeout,self._client.get_port()))
+
+    async def _wait_for_fd(self,fd,add_watcher,remove_watcher,timeout):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        def set_ready():
+            if not ready.done():
+                ready.set_result(None)
+        add_watcher(fd,set_ready)
+        try:
+            await asyncio.wait_for(ready,timeout)
+        finally:
+            remove_watcher(fd)
+
+    async def _write(self,fd,data,timeout):
+        loop = asyncio.get_running_loop()
+        data = memoryview(data)
+        while data:
+            try:
+                bytes_written = os.write(fd,data)
+            except BlockingIOError:
+                bytes_written = 0
+            data = data[bytes_written:]
+            if data:
+                await self._wait_for_fd(fd,loop.add_writer,loop.remove_writer,timeout)
+
+    async def _readline(self,fd,timeout):
+        '''
+        Returns the next newline terminated response or None if no complete
+        response arrives within timeout seconds.
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while b'\n' not in self._read_buffer:
+            try:
+                data = os.read(fd,4096)
+            except BlockingIOError:
+                data = None
+            if data:
+                self._read_buffer += data
+                continue
+            time_remaining = deadline - time.monotonic()
+            if time_remaining <= 0:
+                return None
+            try:
+                await self._wait_for_fd(fd,loop.add_reader,loop.remove_reader,time_remaining)
+            except asyncio.TimeoutError:
+                return None
+        line_end = self._read_buffer.index(b'\n') + 1
+        line = bytes(self._read_buffer[:line_end])
+        # only one request is in flight, so bytes after its response are
+        # stale and must not be left for the next reader
+        self._read_buffer.clear()
+        return line.decode('utf-8')
+
+    def close(self):
+        '''
+        Close the device serial port.
+        '''
+        self._client.close()
+
+    def get_port(self):
+        return self._client.get_port()
+
+    def get_methods(self):
+        '''
+        Get a list of modular methods automatically attached as coroutines.
+        '''
+        return self._client.get_methods()
+
+    async def call_get_result(self,method_name,*args):
+        request_id,request = self._client._call_to_request((method_name,) + args)
+        return await self._send_request_get_result(request_id,*args)
+
+    async def call(self,method_name,*args):
+        await self.call_get_result(method_name,*args)
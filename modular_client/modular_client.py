@@ -1,33 +1,108 @@
-import serial
 import time
 import atexit
 import json
 import functools
+import itertools
+import contextlib
+import array
+import threading
+import collections
+import warnings
+import concurrent.futures
 import operator
 import platform
 import os
-import inflection
-import sre_yield
-
-from serial_interface import SerialInterface, SerialInterfaces, find_serial_interface_ports, WriteFrequencyError
+import hashlib
+import shutil
+import tempfile
+import keyword
+from timeit import default_timer as timer
 
 try:
-    from pkg_resources import get_distribution, DistributionNotFound
-    _dist = get_distribution('modular_client')
-    # Normalize case for Windows systems
-    dist_loc = os.path.normcase(_dist.location)
-    here = os.path.normcase(__file__)
-    if not here.startswith(os.path.join(dist_loc, 'modular_client')):
-        # not installed, but there is another version that *is*
-        raise DistributionNotFound
-except (ImportError,DistributionNotFound):
-    __version__ = None
-else:
-    __version__ = _dist.version
+    import orjson
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+    orjson = None
 
 
 DEBUG = False
 BAUDRATE = 115200
+_encode_json = json.JSONEncoder(separators=(',',':')).encode
+if orjson is None:
+    def _encode_json_bytes(obj):
+        return _encode_json(obj).encode()
+else:
+    # accept the numpy values and int keyed dicts the json module encodes
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    def _encode_json_bytes(obj):
+        try:
+            return orjson.dumps(obj,option=_ORJSON_OPTIONS)
+        except TypeError:
+            # orjson.JSONEncodeError is a TypeError, raised for values like
+            # integers wider than 64 bits
+            return _encode_json(obj).encode()
+USE_CACHE = True
+USE_REGISTRY = False
+PORT_PROBE_MAX_WORKERS = 16
+_STREAM_SIZE = 4096
+_PORT_PROBE_POLL_PERIOD = 0.05
+_NAME_CACHE_SIZE = 1024
+# marks parameters not yet given when mapping keyword arguments to positions
+_MISSING = object()
+
+def __getattr__(name):
+    # the version lookup and serial_interface, which imports pkg_resources,
+    # are slow, so they are deferred until first use
+    if name == '__version__':
+        version = _get_version()
+        globals()['__version__'] = version
+        return version
+    if name in ['SerialInterface','SerialInterfaces','WriteFrequencyError']:
+        return getattr(_import_serial_interface(),name)
+    raise AttributeError('module {0} has no attribute {1}'.format(__name__,name))
+
+def _get_version():
+    try:
+        from importlib.metadata import distribution, PackageNotFoundError
+    except ImportError:
+        return None
+    try:
+        dist = distribution('modular_client')
+    except PackageNotFoundError:
+        return None
+    # Normalize case for Windows systems
+    dist_loc = os.path.normcase(os.path.abspath(str(dist.locate_file('modular_client'))))
+    here = os.path.normcase(os.path.abspath(__file__))
+    if not here.startswith(dist_loc):
+        # not installed, but there is another version that *is*
+        return None
+    return dist.version
+
+def _import_serial_interface():
+    import serial_interface
+    return serial_interface
+
+def _create_serial_interface(*args,**kwargs):
+    return _import_serial_interface().SerialInterface(*args,**kwargs)
+
+def find_serial_interface_ports(try_ports=None,debug=False):
+    '''
+    Returns the available serial ports, see
+    serial_interface.find_serial_interface_ports.
+    '''
+    return _import_serial_interface().find_serial_interface_ports(try_ports=try_ports,debug=debug)
+
+@functools.lru_cache(maxsize=_NAME_CACHE_SIZE)
+def _underscore(name):
+    import inflection
+    return inflection.underscore(name)
+
+@functools.lru_cache(maxsize=_NAME_CACHE_SIZE)
+def _camelize(name):
+    import inflection
+    return inflection.camelize(name,False)
+
 
 class ModularClient(object):
     '''ModularClient contains an instance of serial_interface.SerialInterface and
@@ -47,12 +122,71 @@ class ModularClient(object):
     dev = ModularClient(port='/dev/ttyACM0') # Linux specific port
     dev = ModularClient(port='/dev/tty.usbmodem262471') # Mac OS X specific port
     dev = ModularClient(port='COM3') # Windows specific port
+    # Remember which device is on which usb port, so later searches only
+    # verify the remembered port instead of probing every port:
+    dev = ModularClient(serial_number=2,use_registry=True)
     dev.get_device_id()
     dev.get_methods()
+    # Method docstrings are cached on disk per firmware, so later
+    # constructions only need a few requests. To bypass or refresh the cache:
+    dev = ModularClient(port='/dev/ttyACM0',use_cache=False)
+    dev = ModularClient(port='/dev/ttyACM0',refresh_cache=True)
+    # Fetch each method docstring only when it is first read, and optionally
+    # create each method only when it is first accessed:
+    dev = ModularClient(port='/dev/ttyACM0',lazy=True)
+    dev = ModularClient(port='/dev/ttyACM0',lazy_methods=True)
+    # Skip method discovery on devices running firmware saved with save_api,
+    # and write a stub file for IDE completion from the same files:
+    dev.save_api('api')
+    dev = ModularClient(port='/dev/ttyACM0',api='api')
+    from modular_client import save_api_stub
+    save_api_stub('api','modular_device.pyi')
+    # Send several calls back to back and get their results in order:
+    dev.call_many(['get_device_id',('set_serial_number',2),'get_device_info'])
+    # Pass arguments by parameter name, with keywords or a single dict:
+    dev.set_serial_number(serial_number=2)
+    dev.set_serial_number({'serial_number':2})
+    # Set the read timeout and the spacing between requests from measured round
+    # trip times instead of fixed delays:
+    dev = ModularClient(port='/dev/ttyACM0',adaptive_timing=True)
+    dev.get_timing()
+    # Record per method call counts, bytes, times and latency histograms:
+    dev = ModularClient(port='/dev/ttyACM0',metrics=True)
+    dev.get_metrics()
+    dev.reset_metrics()
+    # Call a method over and over in the background and read the buffered
+    # timestamped results in batches:
+    dev.start_stream('get_device_id',size=1024)
+    timestamps, results = dev.read_stream()
+    dev.stop_stream()
+    # Clients may be shared by threads, and by an AsyncModularClient wrapping
+    # them. Requests take turns in the order they are made and can limit how
+    # long they wait for their turn:
+    dev = ModularClient(port='/dev/ttyACM0',request_timeout=1.0)
+    with dev.request_timeout(0.1):
+        dev.get_device_id()
+    # Give each request a unique id so many requests, from many threads, can be
+    # in flight at once and stale responses are skipped:
+    dev = ModularClient(port='/dev/ttyACM0',unique_ids=True)
+    # Find the same device again after it resets or its port changes, keeping
+    # the bound methods, or do it automatically when a request goes unanswered:
+    dev.reconnect()
+    dev = ModularClient(port='/dev/ttyACM0',auto_reconnect=True)
+    # Retry get methods that time out or get garbled responses, with backoff:
+    from modular_client import RetryPolicy
+    dev = ModularClient(port='/dev/ttyACM0',retry_policy=RetryPolicy(max_retries=5))
     '''
     _TIMEOUT = 0.05
     _WRITE_READ_DELAY = 0.001
     _WRITE_WRITE_DELAY = 0.005
+    _ADAPTIVE_TIMING_WINDOW = 64
+    _ADAPTIVE_TIMEOUT_FACTOR = 4
+    _ADAPTIVE_MAX_TIMEOUT = 1.0
+    _ADAPTIVE_WRITE_WRITE_FRACTION = 0.25
+    _BATCH_WINDOW = 8
+    _MAX_READ_ATTEMPTS = 100
+    _RECONNECT_TIMEOUT = 10.0
+    _RECONNECT_POLL_PERIOD = 0.1
     _METHOD_ID_GET_METHOD_IDS = 0
     _VERBOSE_HELP_STRING = '??'
 
@@ -79,23 +213,103 @@ class ModularClient(object):
             kwargs.update({'write_read_delay': self._WRITE_READ_DELAY})
         if 'write_write_delay' not in kwargs:
             kwargs.update({'write_write_delay': self._WRITE_WRITE_DELAY})
+        if 'metrics' in kwargs:
+            metrics = kwargs.pop('metrics')
+        else:
+            metrics = False
+        if metrics:
+            self._metrics = _Metrics()
+        else:
+            self._metrics = None
+        if 'unique_ids' in kwargs:
+            self._unique_ids = kwargs.pop('unique_ids')
+        else:
+            self._unique_ids = False
+        if 'request_timeout' in kwargs:
+            self._request_timeout = kwargs.pop('request_timeout')
+        else:
+            self._request_timeout = None
+        self._request_lock = _FairLock()
+        self._request_timeout_local = threading.local()
+        if 'adaptive_timing' in kwargs:
+            self._adaptive_timing = kwargs.pop('adaptive_timing')
+        else:
+            self._adaptive_timing = False
+        if 'retry_policy' in kwargs:
+            retry_policy = kwargs.pop('retry_policy')
+            if retry_policy is True:
+                retry_policy = RetryPolicy()
+            self._retry_policy = retry_policy or None
+        else:
+            self._retry_policy = None
+        if 'auto_reconnect' in kwargs:
+            self._auto_reconnect = kwargs.pop('auto_reconnect')
+        else:
+            self._auto_reconnect = False
+        self._reconnecting = False
         if 'name' in kwargs:
             name = kwargs.pop('name')
         if 'form_factor' in kwargs:
             form_factor = kwargs.pop('form_factor')
         if 'serial_number' in kwargs:
             serial_number = kwargs.pop('serial_number')
+        if 'use_cache' in kwargs:
+            self._use_cache = kwargs.pop('use_cache')
+        else:
+            self._use_cache = USE_CACHE
+        if 'refresh_cache' in kwargs:
+            self._refresh_cache = kwargs.pop('refresh_cache')
+        else:
+            self._refresh_cache = False
+        if 'cache_dir' in kwargs:
+            self._cache_dir = kwargs.pop('cache_dir')
+        else:
+            self._cache_dir = None
+        if 'api' in kwargs:
+            api = kwargs.pop('api')
+            if isinstance(api,str):
+                api = _load_api(api)
+            self._api = api
+        else:
+            self._api = None
+        if 'lazy_methods' in kwargs:
+            self._lazy_methods = kwargs.pop('lazy_methods')
+        else:
+            self._lazy_methods = False
+        if 'lazy' in kwargs:
+            self._lazy = kwargs.pop('lazy') or self._lazy_methods
+        else:
+            self._lazy = self._lazy_methods
+        if 'use_registry' in kwargs:
+            use_registry = kwargs.pop('use_registry')
+        else:
+            use_registry = None
         if ('port' not in kwargs) or (kwargs['port'] is None):
             port =  find_modular_device_port(baudrate=kwargs['baudrate'],
                                              name=name,
                                              form_factor=form_factor,
                                              serial_number=serial_number,
                                              try_ports=try_ports,
-                                             debug=kwargs['debug'])
+                                             debug=kwargs['debug'],
+                                             use_registry=use_registry,
+                                             cache_dir=self._cache_dir)
             kwargs.update({'port': port})
 
         t_start = time.time()
-        self._serial_interface = SerialInterface(*args,**kwargs)
+        self._serial_interface = _create_serial_interface(*args,**kwargs)
+        self._serial_interface_args = (args,kwargs)
+        self._round_trip_times = collections.deque(maxlen=self._ADAPTIVE_TIMING_WINDOW)
+        self._camel_names = {}
+        self._underscored_names = {}
+        self._stream_thread = None
+        self._stream_buffer = None
+        self._response_reader_thread = None
+        if self._unique_ids:
+            self._start_response_reader()
+        if self._adaptive_timing:
+            # readline already waits for the response, so there is no need to
+            # sleep between writing a request and reading its response
+            self._serial_interface._write_read_delay = 0
         atexit.register(self._exit_modular_client)
         self._create_methods()
         # store the device id to output during debugging
@@ -111,125 +325,725 @@ class ModularClient(object):
         pass
 
     def _args_to_request(self,*args):
-        request = json.dumps(args,separators=(',',':'))
+        request = _encode_json(args)
         request += '\n';
         return request
 
     def _handle_response(self,response,request_id):
-        if response is None:
-            error_message = 'Did not receive server response.'
-            raise IOError(error_message)
+        return response_to_result(response,request_id)
+
+    def _send_request_get_result(self,*args):
+        '''
+        Sends request to server over serial port and
+        returns response result
+        '''
+        if self._metrics is not None:
+            time_start = timer()
+        else:
+            time_start = None
+        if self._unique_ids:
+            request_id = next(self._request_ids)
+            request = self._args_to_unique_id_request(request_id,*args)
+        else:
+            request_id = args[0]
+            request = self._args_to_request(*args)
+        return self._send_request(request.encode(),request_id,args[0],time_start)
+
+    def _send_request(self,request,request_id,method_id,time_start=None,retry=True):
+        '''
+        Writes an encoded request and returns the result of the response that
+        matches request_id. time_start is when encoding the request started and
+        is only needed to record metrics. Unless retry is False, a failed
+        request is retried by the retry policy and, with auto_reconnect, a
+        request that gets no response reconnects to the device.
+        '''
+        serial_interface = self._serial_interface
+        metrics = self._metrics
+        self._debug_print('request', request)
+        if metrics is not None:
+            time_serialized = timer()
+            if time_start is None:
+                time_start = time_serialized
+        response = None
+        response_dict = None
         try:
-            response_dict = json_string_to_dict(response)
+            if self._unique_ids:
+                future = self._submit_request(request_id,request)
+                response,response_dict = self._wait_for_response(request_id,future)
+            else:
+                with self._request_turn():
+                    response = self._write_read(request)
+                    if metrics is not None:
+                        time_received = timer()
+                    # the timing state and port timeout are shared with the
+                    # requests of other threads
+                    if self._adaptive_timing and response:
+                        self._update_timing(request,response)
+            if (metrics is not None) and self._unique_ids:
+                time_received = timer()
+            self._debug_print('response', response)
+            if response_dict is not None:
+                result = self._handle_response(response_dict,request_id)
+            else:
+                result = self._handle_response(response,request_id)
         except Exception as e:
-            error_message = 'Error:\n{0}\nUnable to parse server response:\n{1}'.format(str(e),response)
-            raise IOError(error_message)
-        try:
-            response_id  = response_dict.pop('id')
-        except KeyError:
-            error_message = 'Server response does not contain id member:\n{0}'.format(response)
-            raise IOError(error_message)
-        if not response_id == request_id:
-            error_message = 'Response id:\n{0}\nDoes not match request id:\n{1}\nin response:{2}'.format(response_id,request_id,response)
-            raise IOError(error_message)
+            if metrics is not None:
+                metrics.record_error(self._get_method_name(method_id),len(request),response)
+            if not retry:
+                raise
+            # waiting too long for a turn is not a sign of a lost connection
+            lost = (response is None) and ((not isinstance(e,TimeoutError)) or isinstance(e,ResponseTimeoutError))
+            if self._auto_reconnect and lost and (not self._reconnecting):
+                return self._reconnect_and_retry(request,request_id,method_id,serial_interface,e)
+            if (self._retry_policy is not None) and self._retry_policy.should_retry(self._get_method_name(method_id),e):
+                return self._retry_request(request,request_id,method_id,e)
+            raise
+        if metrics is not None:
+            metrics.record(self._get_method_name(method_id),
+                           len(request),
+                           len(response),
+                           time_serialized - time_start,
+                           time_received - time_serialized,
+                           timer() - time_received)
+        return result
+
+    def _reconnect_and_retry(self,request,request_id,method_id,serial_interface,error):
+        '''
+        Reconnects after a request on serial_interface got no response, unless
+        another thread already has, then sends the request again if its method
+        is idempotent, as judged by the retry policy or by default by a name
+        starting with get, and is still in the method table. Otherwise the
+        original error is raised once the device is reconnected.
+        '''
+        method_name = self._get_method_name(method_id)
+        if self._retry_policy is not None:
+            idempotent = self._retry_policy.idempotent(method_name)
+        else:
+            idempotent = method_name.startswith('get')
+        self._request_lock.acquire()
         try:
-            error = response_dict.pop('error')
-            try:
-                message = error.pop('message')
-            except KeyError:
-                message = ''
+            if self._serial_interface is serial_interface:
+                self.reconnect()
+        finally:
+            self._request_lock.release()
+        if (not idempotent) or (self._get_method_name(method_id) != method_name):
+            raise error
+        return self._send_request(request,request_id,method_id,retry=False)
+
+    def _retry_request(self,request,request_id,method_id,error):
+        retry_policy = self._retry_policy
+        for delay in retry_policy.get_delays():
+            time.sleep(delay)
             try:
-                data = error.pop('data')
-            except KeyError:
-                data = ''
+                return self._send_request(request,request_id,method_id,retry=False)
+            except Exception as e:
+                if not retry_policy.should_retry(self._get_method_name(method_id),e):
+                    raise
+                error = e
+        raise error
+
+    def _write_read(self,request):
+        '''
+        Writes encoded request bytes, keeping the serial interface write
+        spacing and write read delay, and returns the response line.
+
+        This is SerialInterface.write_read without its encode and readline
+        retry overhead, so it relies on the private lock, write timing and
+        write data attributes of serial_interface, which setup.py pins to the
+        release series they were checked against.
+        '''
+        serial_interface = self._serial_interface
+        with serial_interface._lock:
+            time_since_write_prev = timer() - serial_interface._time_write_prev
+            if time_since_write_prev < serial_interface._write_write_delay:
+                time.sleep(serial_interface._write_write_delay - time_since_write_prev)
+            serial_interface._write_data = request
+            serial_interface._bytes_written = serial_interface.write(request)
+            serial_interface._time_write_prev = timer()
+            if not serial_interface._bytes_written:
+                serial_interface._write_data = None
+                raise _import_serial_interface().WriteError('No bytes written.')
+            if serial_interface._write_read_delay > 0:
+                time.sleep(serial_interface._write_read_delay)
+            return self._read_response_line()
+
+    def _args_to_unique_id_request(self,request_id,method_id,*params):
+        request = _encode_json({'id': request_id,'method': method_id,'params': params})
+        request += '\n'
+        return request
+
+    def _start_response_reader(self):
+        '''
+        Starts the thread that reads every response and hands it to the request
+        waiting for its id. Responses with unknown ids are stale and dropped.
+        '''
+        self._request_ids = itertools.count(1)
+        self._pending_responses = {}
+        self._pending_responses_lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(self._BATCH_WINDOW)
+        self._stale_response_count = 0
+        self._serial_interface.reset_input_buffer()
+        self._response_reader_running = True
+        self._response_reader_thread = threading.Thread(target=self._read_responses,daemon=True)
+        self._response_reader_thread.start()
+
+    def _stop_response_reader(self):
+        if self._response_reader_thread is None:
+            return
+        self._response_reader_running = False
+        self._response_reader_thread.join()
+        self._response_reader_thread = None
+
+    def _read_responses(self):
+        line = b''
+        while self._response_reader_running:
             try:
-                code = error.pop('code')
-            except KeyError:
-                code = ''
-            error_message = '(from server) message: {0}, data: {1}, code: {2}'.format(message,data,code)
-            raise IOError(error_message)
-        except KeyError:
+                line += self._serial_interface.readline()
+            except Exception as e:
+                self._fail_pending_responses(e)
+                return
+            if line.endswith(b'\n'):
+                self._dispatch_response(line.decode('utf-8'))
+                line = b''
+        self._fail_pending_responses(IOError('Serial port {0} closed.'.format(self.get_port())))
+
+    def _dispatch_response(self,response):
+        try:
+            response_dict = json_string_to_dict(response)
+            request_id = response_dict['id']
+            with self._pending_responses_lock:
+                future = self._pending_responses.pop(request_id)
+        except Exception:
+            self._stale_response_count += 1
+            self._debug_print('stale response', response)
+            return
+        try:
+            future.set_result((response,response_dict))
+        except concurrent.futures.InvalidStateError:
+            # the request gave up waiting
             pass
+
+    def _fail_pending_responses(self,error):
+        with self._pending_responses_lock:
+            futures = list(self._pending_responses.values())
+            self._pending_responses.clear()
+        for future in futures:
+            try:
+                future.set_exception(error)
+            except concurrent.futures.InvalidStateError:
+                pass
+
+    def _submit_request(self,request_id,request):
+        '''
+        Writes a request with a unique id and returns a future for its response.
+        At most the batch window of requests are in flight at once.
+        '''
+        timeout = getattr(self._request_timeout_local,'timeout',self._request_timeout)
+        if not self._in_flight.acquire(timeout=timeout):
+            raise TimeoutError('Timed out after {0}s waiting for serial port {1}'.format(timeout,self.get_port()))
+        future = concurrent.futures.Future()
+        future.add_done_callback(lambda future: self._in_flight.release())
+        with self._pending_responses_lock:
+            self._pending_responses[request_id] = future
+        if isinstance(request,str):
+            request = request.encode()
         try:
-            result  = response_dict.pop('result')
-        except KeyError:
-            error_message = 'Server response does not contain result member:\n{0}'.format(response)
-            raise IOError(error_message)
-        return result
+            with self._serial_interface._lock:
+                self._serial_interface.write(request)
+        except Exception as e:
+            with self._pending_responses_lock:
+                self._pending_responses.pop(request_id,None)
+            future.set_exception(e)
+            raise
+        return future
 
-    def _send_request_get_result(self,*args):
+    def _wait_for_response(self,request_id,future):
         '''
-        Sends request to server over serial port and
-        returns response result
+        Returns the response and the parsed response for a submitted request, or
+        None and None if no response arrives in time.
         '''
-        request = self._args_to_request(*args)
-        self._debug_print('request', request)
-        response = self._serial_interface.write_read(request,use_readline=True,check_write_freq=True)
-        self._debug_print('response', response)
-        if (type(response) != str):
-            response = response.decode('utf-8')
-        self._debug_print('type(response)', type(response))
-        result = self._handle_response(response,args[0])
-        return result
+        response_timeout = self._serial_interface.timeout*self._MAX_READ_ATTEMPTS
+        try:
+            return future.result(response_timeout)
+        except concurrent.futures.TimeoutError:
+            with self._pending_responses_lock:
+                self._pending_responses.pop(request_id,None)
+            future.cancel()
+            return None,None
+
+    def get_stale_response_count(self):
+        '''
+        Get the number of responses dropped because no request was waiting for
+        their ids. Only counted with unique_ids=True.
+        '''
+        if self._response_reader_thread is None:
+            return 0
+        return self._stale_response_count
+
+    @contextlib.contextmanager
+    def _request_turn(self):
+        '''
+        Waits for this thread's turn to use the serial port. Threads get their
+        turns in the order they asked for them, in the same queue as the
+        requests of an AsyncModularClient wrapping this client.
+        '''
+        timeout = getattr(self._request_timeout_local,'timeout',self._request_timeout)
+        if not self._request_lock.acquire(timeout):
+            raise TimeoutError('Timed out after {0}s waiting for serial port {1}'.format(timeout,self.get_port()))
+        try:
+            yield
+        finally:
+            self._request_lock.release()
+
+    @contextlib.contextmanager
+    def request_timeout(self,timeout):
+        '''
+        Context manager that limits how long requests made by the current
+        thread wait for their turn to use the serial port. A TimeoutError is
+        raised when the wait is longer than timeout seconds.
+        '''
+        previous_timeout = getattr(self._request_timeout_local,'timeout',self._request_timeout)
+        self._request_timeout_local.timeout = timeout
+        try:
+            yield
+        finally:
+            self._request_timeout_local.timeout = previous_timeout
+
+    def _get_method_name(self,method_id):
+        if isinstance(method_id,str):
+            return self._to_underscored_name(method_id)
+        if method_id == self._METHOD_ID_GET_METHOD_IDS:
+            # requested before the method table that names it exists
+            return 'get_method_ids'
+        try:
+            return self._method_names[method_id]
+        except (AttributeError,KeyError,TypeError):
+            return str(method_id)
+
+    def _update_timing(self,request,response):
+        '''
+        Records the round trip time of the last request and sets the read timeout
+        and the spacing between requests from the rolling window of round trip
+        times, instead of using fixed delays. Must be called during the request
+        turn that got the response.
+        '''
+        serial_interface = self._serial_interface
+        # the serial interface records when the request finished being written
+        round_trip_time = timer() - serial_interface._time_write_prev
+        transfer_time = (len(request) + len(response))*10.0/serial_interface.baudrate
+        self._round_trip_times.append((round_trip_time,max(round_trip_time - transfer_time,0)))
+        round_trip_time_max = max([times[0] for times in self._round_trip_times])
+        processing_times = sorted([times[1] for times in self._round_trip_times])
+        processing_time_median = processing_times[len(processing_times)//2]
+        serial_interface._write_write_delay = min(self._WRITE_WRITE_DELAY,
+                                                  self._ADAPTIVE_WRITE_WRITE_FRACTION*processing_time_median)
+        timeout = min(max(self._TIMEOUT,self._ADAPTIVE_TIMEOUT_FACTOR*round_trip_time_max),
+                      self._ADAPTIVE_MAX_TIMEOUT)
+        # changing the timeout reconfigures the serial port, so only change it
+        # when it differs significantly
+        if abs(timeout - serial_interface.timeout) > 0.25*serial_interface.timeout:
+            serial_interface.timeout = timeout
+
+    def get_timing(self):
+        '''
+        Get the current read timeout, write delays and measured round trip times
+        in seconds. Round trip times are only measured with adaptive_timing=True.
+        '''
+        serial_interface = self._serial_interface
+        timing = {}
+        timing['adaptive'] = self._adaptive_timing
+        timing['timeout'] = serial_interface.timeout
+        timing['write_read_delay'] = serial_interface._write_read_delay
+        timing['write_write_delay'] = serial_interface._write_write_delay
+        # copying the deque is atomic, iterating it while requests append is not
+        round_trip_times = sorted([times[0] for times in list(self._round_trip_times)])
+        if round_trip_times:
+            timing['round_trip_time_median'] = round_trip_times[len(round_trip_times)//2]
+            timing['round_trip_time_max'] = round_trip_times[-1]
+        return timing
 
     def _get_method_dict(self):
         method_dict = self._send_request_get_result(self._METHOD_ID_GET_METHOD_IDS)
-        method_dict = dict([(inflection.underscore(method_name),method_id) for (method_name,method_id) in method_dict.items()])
+        self._index_method_names(method_dict.keys())
+        method_dict = dict([(self._underscored_names[method_name],method_id) for (method_name,method_id) in method_dict.items()])
         return method_dict
 
+    def _index_method_names(self,device_method_names):
+        '''
+        Indexes the camel case method names reported by the device and the
+        underscored method names of the client in both directions, so calls
+        by name look names up instead of converting them.
+        '''
+        camel_names = {}
+        underscored_names = {}
+        for device_method_name in device_method_names:
+            method_name = _underscore(device_method_name)
+            camel_names[method_name] = device_method_name
+            camel_names[device_method_name] = device_method_name
+            underscored_names[device_method_name] = method_name
+            underscored_names[method_name] = method_name
+        self._camel_names = camel_names
+        self._underscored_names = underscored_names
+
+    def _to_camel_name(self,method_name):
+        try:
+            return self._camel_names[method_name]
+        except KeyError:
+            return _camelize(method_name)
+
+    def _to_underscored_name(self,method_name):
+        try:
+            return self._underscored_names[method_name]
+        except KeyError:
+            return _underscore(method_name)
+
     def _send_request_by_method_id(self,method_id,*args):
         method_args = [method_id]
         method_args.extend(args)
         result = self._send_request_get_result(*method_args)
         return result
 
-    def _method_func_base(self,method_id,*args):
-        if len(args) == 1 and type(args[0]) is dict:
-            args_dict = args[0]
-            args_list = self._args_dict_to_list(args_dict)
-        else:
-            args_list = args
+    def _raise_with_context(self,e):
+        serial_interface = self._serial_interface
+        raise e from _ErrorContext(self._device_id,
+                                   serial_interface.port,
+                                   serial_interface._write_data,
+                                   serial_interface._read_data)
+
+    def _get_method_help(self,method_name,method_id):
         try:
-            result = self._send_request_by_method_id(method_id,*args_list)
-        except Exception as e:
-            device_id = self._device_id
-            port = self.get_port()
-            write_data = self._serial_interface._write_data
-            read_data = self._serial_interface._read_data
-            error_message = '\ndevice_id:\n{0}\nserial_port:\n{1}\nserial_write_data:\n{2}\nserial_read_data:\n{3}'.format(device_id,port,write_data,read_data)
-            raise e from Exception(error_message)
-        return result
+            method_help = self._method_help_dict[method_name]
+        except KeyError:
+            method_help = self._send_request_get_result(method_id,self._VERBOSE_HELP_STRING)
+            self._method_help_dict[method_name] = method_help
+        return method_help
 
-    def _create_method_docstring(self,method_id):
-        docstring = str(self._send_request_get_result(method_id,self._VERBOSE_HELP_STRING))
+    def _create_method_docstring(self,method_name,method_id):
+        docstring = str(self._get_method_help(method_name,method_id))
         return docstring
 
+    def _create_method(self,method_name,method_id):
+        method_func = _ModularMethod(self,method_name,method_id)
+        if not self._lazy:
+            method_func._docstring = self._create_method_docstring(method_name,method_id)
+        return method_func
+
     def _create_methods(self):
-        self._method_dict = self._get_method_dict()
+        self._method_help_dict = {}
+        self._method_parameters = {}
+        if (self._api is not None) and self._load_api_methods():
+            cache_path = None
+            cache_hit = True
+        else:
+            if self._api is not None:
+                warnings.warn('Device firmware does not match the saved api, requesting methods from the device',RuntimeWarning)
+            self._method_dict = self._get_method_dict()
+            cache_path = self._get_method_cache_path()
+            cache_hit = self._load_method_cache(cache_path)
+        self._method_names = dict([(method_id,method_name) for (method_name,method_id) in self._method_dict.items()])
+        if self._lazy_methods:
+            # methods are created on first access by __getattr__
+            return
         for method_name, method_id in sorted(self._method_dict.items()):
-            method_func = functools.partial(self._method_func_base, method_id)
-            method_func.__name__ = method_name
-            method_func.__doc__ = self._create_method_docstring(method_id)
-            setattr(self,method_name,method_func)
-
-    def _args_dict_to_list(self,args_dict):
-        key_set = set(args_dict.keys())
-        try:
-            order_list = sorted([(num,name) for (name,num) in order_dict.items()])
-        except AttributeError:
-            order_list = sorted([(num,name) for (name,num) in order_dict.iteritems()])
-        args_list = [args_dict[name] for (num, name) in order_list]
+            setattr(self,method_name,self._create_method(method_name,method_id))
+        if not (cache_hit or self._lazy):
+            self._save_method_cache(cache_path)
+
+    def __getattr__(self,name):
+        method_dict = self.__dict__.get('_method_dict')
+        if (method_dict is None) or (name not in method_dict):
+            raise AttributeError('{0} object has no attribute {1}'.format(type(self).__name__,name))
+        method_func = self._create_method(name,method_dict[name])
+        setattr(self,name,method_func)
+        return method_func
+
+    def __dir__(self):
+        names = set(super(ModularClient,self).__dir__())
+        names.update(self.__dict__.get('_method_dict',{}).keys())
+        return sorted(names)
+
+    def _get_api_methods(self):
+        '''
+        Returns the methods of the saved apis of the firmware running on the
+        device, checked with a single request, or None if the saved apis do
+        not cover that firmware.
+        '''
+        try:
+            device_info = self._send_request_get_result('getDeviceInfo')
+            device_firmware = dict([(firmware_info['name'],firmware_info.get('version')) for firmware_info in device_info['firmware']])
+        except (IOError,KeyError,TypeError):
+            return None
+        return _select_api_methods(self._api,device_firmware)
+
+    def _load_api_methods(self):
+        '''
+        Creates the method table from a saved api instead of requesting it,
+        after checking with a single request that the device runs the same
+        firmware. Methods are called by name, so no method ids are needed.
+        Returns False if the firmware does not match.
+        '''
+        api_methods = self._get_api_methods()
+        if api_methods is None:
+            return False
+        self._index_method_names(api_methods.keys())
+        method_dict = {}
+        method_help_dict = {}
+        for method_id, method_help in api_methods.items():
+            method_name = self._underscored_names[method_id]
+            method_dict[method_name] = method_id
+            if method_help is not None:
+                method_help_dict[method_name] = method_help
+        self._method_dict = method_dict
+        self._method_help_dict = method_help_dict
+        self._debug_print('Loaded methods from saved api')
+        return True
+
+    def _get_method_cache_path(self):
+        '''
+        Returns the cache file path for the firmware running on the device, or
+        None if the cache is disabled or the firmware cannot be identified.
+        '''
+        if not self._use_cache:
+            return None
+        try:
+            device_info = self._send_request_get_result('getDeviceInfo')
+            firmware = device_info['firmware']
+        except (IOError,KeyError,TypeError):
+            return None
+        firmware_identity = json.dumps([firmware,self._method_dict],sort_keys=True,separators=(',',':'))
+        firmware_hash = hashlib.sha256(firmware_identity.encode('utf-8')).hexdigest()
+        cache_dir = self._cache_dir
+        if cache_dir is None:
+            cache_dir = get_cache_dir()
+        return os.path.join(cache_dir,'methods_' + firmware_hash + '.json')
+
+    def _load_method_cache(self,cache_path):
+        if (cache_path is None) or self._refresh_cache:
+            return False
+        try:
+            with open(cache_path,'r') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError,ValueError):
+            return False
+        try:
+            if cache['method_dict'] != self._method_dict:
+                return False
+            method_help_dict = cache['method_help']
+        except (KeyError,TypeError):
+            return False
+        if set(method_help_dict.keys()) != set(self._method_dict.keys()):
+            return False
+        self._method_help_dict = method_help_dict
+        self._debug_print('Loaded method cache', cache_path)
+        return True
+
+    def _save_method_cache(self,cache_path):
+        if cache_path is None:
+            return
+        cache = {}
+        cache['method_dict'] = self._method_dict
+        cache['method_help'] = self._method_help_dict
+        cache_dir = os.path.dirname(cache_path)
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            # write to a temporary file first so concurrent processes never
+            # read a partially written cache file
+            with tempfile.NamedTemporaryFile('w',dir=cache_dir,suffix='.tmp',delete=False) as cache_file:
+                json.dump(cache,cache_file,separators=(',',':'))
+            os.replace(cache_file.name,cache_path)
+        except OSError:
+            return
+        self._debug_print('Saved method cache', cache_path)
+
+    def _get_method_parameters(self,method_name,method_id):
+        '''
+        Returns the parameter names of a method in call order and a dict that
+        maps each name, both as reported by the device and underscored, to its
+        position. Built once per method from the method help.
+        '''
+        try:
+            return self._method_parameters[method_name]
+        except KeyError:
+            pass
+        method_help = self._get_method_help(method_name,method_id)
+        try:
+            parameters = method_help['parameters']
+        except (KeyError,TypeError):
+            raise TypeError('{0}() parameter names are unknown, call it with positional arguments'.format(method_name))
+        parameter_names = []
+        for parameter in parameters:
+            if isinstance(parameter,dict):
+                parameter = parameter['name']
+            parameter_names.append(parameter)
+        parameter_names = tuple(parameter_names)
+        parameter_indexes = {}
+        for parameter_index, parameter_name in enumerate(parameter_names):
+            parameter_indexes[parameter_name] = parameter_index
+            parameter_indexes[_underscore(parameter_name)] = parameter_index
+        method_parameters = (parameter_names,parameter_indexes)
+        self._method_parameters[method_name] = method_parameters
+        return method_parameters
+
+    def _args_to_list(self,method_name,method_id,args,kwargs):
+        '''
+        Returns positional and keyword arguments as a list in parameter order.
+        Raises TypeError on missing, unexpected or repeated arguments before
+        any request is sent.
+        '''
+        parameter_names, parameter_indexes = self._get_method_parameters(method_name,method_id)
+        parameter_count = len(parameter_names)
+        if len(args) > parameter_count:
+            raise TypeError('{0}() takes {1} arguments but {2} were given'.format(method_name,parameter_count,len(args)))
+        args_list = list(args)
+        args_list.extend([_MISSING]*(parameter_count - len(args)))
+        for name, value in kwargs.items():
+            try:
+                parameter_index = parameter_indexes[name]
+            except KeyError:
+                raise TypeError('{0}() got an unexpected keyword argument {1}'.format(method_name,name))
+            if args_list[parameter_index] is not _MISSING:
+                raise TypeError('{0}() got multiple values for argument {1}'.format(method_name,name))
+            args_list[parameter_index] = value
+        if (len(args) + len(kwargs)) < parameter_count:
+            missing_names = [parameter_names[parameter_index] for (parameter_index,value) in enumerate(args_list) if value is _MISSING]
+            raise TypeError('{0}() missing arguments: {1}'.format(method_name,', '.join(missing_names)))
         return args_list
 
     def close(self):
         '''
         Close the device serial port.
         '''
+        self.stop_stream()
+        self._stop_response_reader()
         self._serial_interface.close()
 
     def get_port(self):
         return self._serial_interface.port
 
+    def reconnect(self,timeout=None):
+        '''
+        Reopens the serial port to the same device after it resets or its USB
+        port enumerates again, keeping the methods already bound to the client.
+        The device is found by its name, form_factor and serial_number, trying
+        the previous port first, then ports named like it, then every other
+        port, for up to timeout seconds. The method table is reused if the
+        firmware reports the same methods, otherwise the methods are created
+        again. Construct the client with auto_reconnect=True to reconnect when
+        a request gets no response, in which case calls to methods starting
+        with get are sent again.
+        '''
+        if timeout is None:
+            timeout = self._RECONNECT_TIMEOUT
+        self._request_lock.acquire()
+        self._reconnecting = True
+        try:
+            self._stop_response_reader()
+            try:
+                self._serial_interface.close()
+            except Exception:
+                pass
+            port = self._find_device_port(timeout)
+            args,kwargs = self._serial_interface_args
+            kwargs = dict(kwargs)
+            kwargs.update({'port': port})
+            self._serial_interface = _create_serial_interface(*args,**kwargs)
+            self._serial_interface_args = (args,kwargs)
+            if self._adaptive_timing:
+                self._serial_interface._write_read_delay = 0
+            if self._unique_ids:
+                # keep counting so ids still pending elsewhere are not reused
+                request_ids = self._request_ids
+                self._start_response_reader()
+                self._request_ids = request_ids
+            if not self._method_table_matches():
+                self._recreate_methods()
+            self._debug_print('Reconnected on port', port)
+        finally:
+            self._reconnecting = False
+            self._request_lock.release()
+
+    def _find_device_port(self,timeout):
+        device_id = self._device_id
+        previous_port = self.get_port()
+        baudrate = self._serial_interface.baudrate
+        def matches(probed_device_id):
+            if not isinstance(probed_device_id,dict):
+                return False
+            for key in ['name','form_factor','serial_number']:
+                if probed_device_id.get(key) != device_id.get(key):
+                    return False
+            return True
+        time_end = time.time() + timeout
+        while True:
+            if matches(_probe_modular_device_port(previous_port,baudrate,self.debug)):
+                return previous_port
+            ports = [port for port in find_serial_interface_ports(debug=self.debug) if port != previous_port]
+            # a device that enumerates again usually gets a port with the same
+            # name and a different number, like /dev/ttyACM1 after /dev/ttyACM0
+            port_prefix = previous_port.rstrip('0123456789')
+            likely_ports = [port for port in ports if port.rstrip('0123456789') == port_prefix]
+            other_ports = [port for port in ports if port not in likely_ports]
+            for port_group in [likely_ports,other_ports]:
+                if len(port_group) == 0:
+                    continue
+                max_workers = min(PORT_PROBE_MAX_WORKERS,len(port_group))
+                for port,probed_device_id in _probe_modular_device_ports_concurrently(port_group,baudrate,self.debug,False,max_workers,None):
+                    if matches(probed_device_id):
+                        return port
+            if time.time() >= time_end:
+                raise RuntimeError('Could not find device {0} again after {1}s.'.format(device_id,timeout))
+            time.sleep(self._RECONNECT_POLL_PERIOD)
+
+    def _method_table_matches(self):
+        if self._api is not None:
+            api_methods = self._get_api_methods()
+            return (api_methods is not None) and (set(api_methods.keys()) == set(self._method_dict.values()))
+        try:
+            return self._get_method_dict() == self._method_dict
+        except IOError:
+            return False
+
+    def _recreate_methods(self):
+        '''
+        Creates the methods again after the firmware changed. Methods already
+        held by the application are updated in place when the new firmware
+        still has them.
+        '''
+        methods = {}
+        for method_name in self._method_dict:
+            method = self.__dict__.pop(method_name,None)
+            if isinstance(method,_ModularMethod):
+                methods[method_name] = method
+        self._create_methods()
+        for method_name, method in methods.items():
+            if method_name not in self._method_dict:
+                continue
+            method._set_method_id(self._method_dict[method_name])
+            method._docstring = None
+            setattr(self,method_name,method)
+
+    def get_metrics(self):
+        '''
+        Get a snapshot of the per method call counts, error counts, bytes
+        written and read, serialize, wire and parse times in seconds and
+        latency histograms. Latency histograms map upper bucket bounds in
+        seconds to call counts. Returns None unless constructed with
+        metrics=True. Calls sent back to back by call_many, stream windows,
+        unique id batches and AsyncModularClient are not recorded, since
+        their round trips overlap and have no per call latency.
+        '''
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
+
+    def reset_metrics(self):
+        '''
+        Clear all recorded metrics.
+        '''
+        if self._metrics is not None:
+            self._metrics.reset()
+
     def get_methods(self):
         '''
         Get a list of modular methods automatically attached as class methods.
@@ -237,12 +1051,237 @@ class ModularClient(object):
         return sorted(list(self._method_dict.keys()))
 
     def call_get_result(self,method_name,*args):
-        method_name = inflection.camelize(method_name,False)
+        method_name = self._to_camel_name(method_name)
         return self._send_request_get_result(method_name,*args)
 
     def call(self,method_name,*args):
         self.call_get_result(method_name,*args)
 
+    def call_many(self,calls,window=None,return_exceptions=False):
+        '''
+        Sends a sequence of method calls to the device back to back, keeping up
+        to window requests in flight, and returns a list of their results in
+        order. Each call is either a method name or a tuple of a method name
+        followed by its arguments. Every response is read even if some calls
+        fail, then the first error is raised, unless return_exceptions is True,
+        in which case errors are returned in place of results.
+        '''
+        if window is None:
+            window = self._BATCH_WINDOW
+        if self._unique_ids:
+            results = self._call_many_unique_ids(calls)
+        else:
+            results = self._call_many_in_order(calls,window)
+        if not return_exceptions:
+            for result in results:
+                if isinstance(result,Exception):
+                    raise result
+        return results
+
+    def _call_many_unique_ids(self,calls):
+        futures = []
+        for call in calls:
+            method_id,args = self._split_call(call)
+            request_id = next(self._request_ids)
+            request = self._args_to_unique_id_request(request_id,method_id,*args)
+            self._debug_print('request', request)
+            futures.append((request_id,self._submit_request(request_id,request)))
+        return [self._wait_for_batch_result(request_id,future) for request_id,future in futures]
+
+    def _wait_for_batch_result(self,request_id,future):
+        try:
+            response,response_dict = self._wait_for_response(request_id,future)
+            return self._handle_response(response_dict,request_id)
+        except IOError as e:
+            return e
+
+    def _call_many_in_order(self,calls,window):
+        requests = [self._call_to_request(call) for call in calls]
+        results = []
+        pending = collections.deque()
+        with self._request_turn():
+            # a reconnect may replace the serial interface during the wait
+            serial_interface = self._serial_interface
+            with serial_interface._lock:
+                for request_id,request in requests:
+                    if len(pending) >= window:
+                        results.append(self._read_batch_result(pending.popleft()))
+                    self._debug_print('request', request)
+                    serial_interface.write(request.encode())
+                    pending.append(request_id)
+                while pending:
+                    results.append(self._read_batch_result(pending.popleft()))
+        return results
+
+    def _split_call(self,call):
+        '''
+        Returns the request method id and the arguments of a call given as a
+        method name or a tuple of a method name followed by its arguments.
+        '''
+        if isinstance(call,str):
+            method_name = call
+            args = ()
+        else:
+            method_name = call[0]
+            args = tuple(call[1:])
+        if method_name in self._method_dict:
+            method_id = self._method_dict[method_name]
+        elif isinstance(method_name,str):
+            method_id = self._to_camel_name(method_name)
+        else:
+            method_id = method_name
+        return method_id,args
+
+    def _call_to_request(self,call):
+        method_id,args = self._split_call(call)
+        return method_id,self._args_to_request(method_id,*args)
+
+    def _read_response_line(self):
+        '''
+        Reads one newline terminated response, waiting up to the maximum number
+        of read attempts for the device to finish writing it.
+        '''
+        serial_interface = self._serial_interface
+        line = b''
+        for attempt in range(self._MAX_READ_ATTEMPTS):
+            line += serial_interface.readline()
+            if line.endswith(b'\n'):
+                break
+        serial_interface._read_data = line
+        if not line:
+            return None
+        return line.decode('utf-8')
+
+    def _read_batch_result(self,request_id):
+        response = self._read_response_line()
+        self._debug_print('response', response)
+        try:
+            return self._handle_response(response,request_id)
+        except IOError as e:
+            return e
+
+    def start_stream(self,method_name,*args,size=_STREAM_SIZE,period=0,window=None,dtype=None):
+        '''
+        Starts a background thread that calls method_name with args over and
+        over and stores each result with its time.time() timestamp in a ring
+        buffer of size samples. When period is 0, up to window requests are kept
+        in flight for the highest sample rate, otherwise one request is sent
+        every period seconds. When dtype is given, results are stored in a
+        preallocated numpy array of that dtype. When the buffer is full, the
+        oldest samples are overwritten and counted as overruns. Other calls may
+        be made while streaming, they are sent between stream requests.
+        '''
+        self.stop_stream()
+        if window is None:
+            window = self._BATCH_WINDOW
+        call = (method_name,) + args
+        self._stream_buffer = _RingBuffer(size,dtype)
+        self._stream_error = None
+        self._stream_stop = threading.Event()
+        self._stream_thread = threading.Thread(target=self._stream,
+                                               args=(call,period,window),
+                                               daemon=True)
+        self._stream_thread.start()
+
+    def _stream(self,call,period,window):
+        request_count = window
+        if period > 0:
+            request_count = 1
+        try:
+            while not self._stream_stop.is_set():
+                time_start = timer()
+                errors = []
+                for result in self._stream_results(call,request_count):
+                    if isinstance(result,Exception):
+                        errors.append(result)
+                    else:
+                        self._stream_buffer.append(time.time(),result)
+                if errors:
+                    self._stream_error = errors[0]
+                    return
+                if period > 0:
+                    time.sleep(max(period - (timer() - time_start),0))
+        except Exception as e:
+            # like a lost serial port or a result that does not fit the dtype
+            self._stream_error = e
+        finally:
+            # wake up readers waiting for samples that will never come
+            self._stream_buffer.close()
+
+    def _stream_results(self,call,request_count):
+        '''
+        Sends request_count copies of call back to back and yields each result,
+        or error, as soon as its response is read.
+        '''
+        if self._unique_ids:
+            method_id,args = self._split_call(call)
+            futures = []
+            for request_index in range(request_count):
+                request_id = next(self._request_ids)
+                request = self._args_to_unique_id_request(request_id,method_id,*args)
+                futures.append((request_id,self._submit_request(request_id,request)))
+            for request_id,future in futures:
+                yield self._wait_for_batch_result(request_id,future)
+            return
+        request_id,request = self._call_to_request(call)
+        request = request.encode()
+        with self._request_turn():
+            # a reconnect may replace the serial interface during the wait
+            serial_interface = self._serial_interface
+            with serial_interface._lock:
+                for request_index in range(request_count):
+                    serial_interface.write(request)
+                for request_index in range(request_count):
+                    yield self._read_batch_result(request_id)
+
+    def stop_stream(self):
+        '''
+        Stops the stream started by start_stream. Samples already buffered may
+        still be read.
+        '''
+        if self._stream_thread is None:
+            return
+        self._stream_stop.set()
+        self._stream_thread.join()
+        self._stream_thread = None
+
+    def read_stream(self,max_count=None,timeout=None):
+        '''
+        Removes and returns up to max_count buffered stream samples, oldest
+        first, as a tuple of timestamps and results. Timestamps are an
+        array.array of floats and results a list, or a numpy array when the
+        stream was started with a dtype. Waits up to timeout seconds for at
+        least one sample, or indefinitely if timeout is None and the stream is
+        running. Raises the error that stopped the stream once every sample
+        before it has been read.
+        '''
+        if self._stream_buffer is None:
+            raise RuntimeError('No stream has been started.')
+        timestamps,results = self._stream_buffer.read(max_count,timeout)
+        if (len(timestamps) == 0) and (self._stream_error is not None):
+            raise self._stream_error
+        return timestamps,results
+
+    def iter_stream(self,max_count=None,timeout=None):
+        '''
+        Yields batches of stream samples from read_stream until the stream is
+        stopped and every buffered sample has been read.
+        '''
+        while True:
+            timestamps,results = self.read_stream(max_count,timeout)
+            if len(timestamps) > 0:
+                yield timestamps,results
+            elif self._stream_buffer.is_closed():
+                return
+
+    def get_stream_overruns(self):
+        '''
+        Get the number of stream samples overwritten before they were read.
+        '''
+        if self._stream_buffer is None:
+            return 0
+        return self._stream_buffer.overruns
+
     def send_json_request(self,request):
         '''
         Sends json request to device over serial port and returns result
@@ -256,22 +1295,30 @@ class ModularClient(object):
             error_message = 'Request does not contain an id:\n{0}'.format(request)
             raise IOError(error_message)
         try:
-            request_python["method"] = inflection.camelize(request_python["method"],False)
+            request_python["method"] = self._to_camel_name(request_python["method"])
         except TypeError:
             pass
         except KeyError:
             error_message = 'Request does not contain a method:\n{0}'.format(request)
             raise IOError(error_message)
-        try:
-            request_python[0] = inflection.camelize(request_python[0],False)
-            request_id = request_python[0]
-        except IndexError:
-            error_message = 'Request does not contain a method:\n{0}'.format(request)
-            raise IOError(error_message)
-        request = json.dumps(request_python,separators=(',',':'))
+        if isinstance(request_python,list):
+            try:
+                request_python[0] = self._to_camel_name(request_python[0])
+                request_id = request_python[0]
+            except IndexError:
+                error_message = 'Request does not contain a method:\n{0}'.format(request)
+                raise IOError(error_message)
+        if self._unique_ids:
+            # replace the request id with a unique one so the response can be
+            # matched while other requests are in flight
+            if isinstance(request_python,list):
+                return self._send_request_get_result(*request_python)
+            return self._send_request_get_result(request_python['method'],*request_python.get('params',[]))
+        request = _encode_json(request_python)
         request += '\n'
         self._debug_print('request', request)
-        response = self._serial_interface.write_read(request,use_readline=True,check_write_freq=True)
+        with self._request_turn():
+            response = self._write_read(request.encode())
         self._debug_print('response', response)
         result = self._handle_response(response,request_id)
         return result
@@ -343,6 +1390,7 @@ class ModularClient(object):
                 result = self.call_get_result('getApi',verbosity,[firmware_info['name']])
                 api = {}
                 api['id'] = 'getApi'
+                api['firmware'] = firmware_info
                 api['result'] = result
                 output_path = os.path.join(output_directory,firmware_info['name'] + '.json')
                 with open(output_path,'w') as api_file:
@@ -352,6 +1400,342 @@ class ModularClient(object):
         except OSError:
             pass
 
+class ModularClientError(IOError):
+    '''
+    Base class of the errors raised when a request fails. It is an IOError,
+    so code that catches IOError still catches it. Only references to the
+    request id and the response are kept when it is raised, its message is
+    formatted when it is rendered.
+    '''
+    # fields shown by repr, which leaves out the possibly long response
+    _REPR_FIELDS = ('request_id',)
+
+    def __init__(self,request_id=None,response=None):
+        super(ModularClientError,self).__init__()
+        self.request_id = request_id
+        self.response = response
+
+    def __reduce__(self):
+        return (_restore_error,(type(self),self.__dict__))
+
+    def __repr__(self):
+        fields = ['{0}={1!r}'.format(field,getattr(self,field,None)) for field in self._REPR_FIELDS]
+        return '{0}({1})'.format(type(self).__name__,', '.join(fields))
+
+class DeviceError(ModularClientError):
+    '''
+    Error response from the device server, with its code, message and data.
+    '''
+    _REPR_FIELDS = ('code','message','request_id')
+
+    def __init__(self,code,message,data,request_id=None,response=None):
+        super(DeviceError,self).__init__(request_id,response)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def __str__(self):
+        return '(from server) message: {0}, data: {1}, code: {2}'.format(self.message,self.data,self.code)
+
+class ResponseTimeoutError(ModularClientError,TimeoutError):
+    '''
+    No complete response arrived before the response timeout.
+    '''
+    def __str__(self):
+        return 'Did not receive server response.'
+
+class ProtocolError(ModularClientError):
+    '''
+    Response that can not be parsed, is missing members or answers another
+    request, which means requests and responses are out of step.
+    '''
+    _REPR_FIELDS = ('request_id','response_id','error')
+
+    def __init__(self,template,request_id=None,response=None,response_id=None,error=None):
+        super(ProtocolError,self).__init__(request_id,response)
+        self.template = template
+        self.response_id = response_id
+        self.error = error
+
+    def __str__(self):
+        return self.template.format(request_id=self.request_id,
+                                    response=self.response,
+                                    response_id=self.response_id,
+                                    error=self.error)
+
+class _ErrorContext(Exception):
+    '''
+    Device id, serial port and last serial data of a failed call, attached as
+    the cause of the error. The serial data is only formatted when the error
+    is rendered.
+    '''
+    def __init__(self,device_id,port,write_data,read_data):
+        super(_ErrorContext,self).__init__()
+        self.device_id = device_id
+        self.port = port
+        self.write_data = write_data
+        self.read_data = read_data
+
+    def __reduce__(self):
+        return (_restore_error,(type(self),self.__dict__))
+
+    def __str__(self):
+        return '\ndevice_id:\n{0}\nserial_port:\n{1}\nserial_write_data:\n{2}\nserial_read_data:\n{3}'.format(self.device_id,self.port,self.write_data,self.read_data)
+
+def _restore_error(error_type,state):
+    error = error_type.__new__(error_type)
+    error.__dict__.update(state)
+    return error
+
+class RetryPolicy(object):
+    '''
+    Retries calls that fail with one of the retry_on errors, by default a
+    missing or out of step response, up to max_retries times. Only calls to
+    idempotent methods are retried, by default methods whose names start
+    with get. The first retry waits backoff seconds and each later retry
+    waits backoff_factor times longer, up to max_backoff seconds.
+    '''
+    def __init__(self,
+                 max_retries=3,
+                 backoff=0.01,
+                 backoff_factor=2.0,
+                 max_backoff=1.0,
+                 retry_on=(ResponseTimeoutError,ProtocolError),
+                 idempotent=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        if idempotent is None:
+            idempotent = lambda method_name: method_name.startswith('get')
+        self.idempotent = idempotent
+
+    def should_retry(self,method_name,error):
+        return isinstance(error,self.retry_on) and self.idempotent(method_name)
+
+    def get_delays(self):
+        '''
+        Returns the delay in seconds before each retry.
+        '''
+        return [min(self.backoff*(self.backoff_factor**retry_index),self.max_backoff) for retry_index in range(self.max_retries)]
+
+class _Metrics(object):
+    '''
+    Per method request counters and latency histograms of a ModularClient.
+    Latencies are counted in power of two buckets of microseconds.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._method_metrics = {}
+
+    def _get_method_metrics(self,method_name):
+        try:
+            return self._method_metrics[method_name]
+        except KeyError:
+            method_metrics = {'calls': 0,
+                              'errors': 0,
+                              'bytes_written': 0,
+                              'bytes_read': 0,
+                              'serialize_time': 0.0,
+                              'wire_time': 0.0,
+                              'parse_time': 0.0,
+                              'latency_histogram': collections.Counter()}
+            self._method_metrics[method_name] = method_metrics
+            return method_metrics
+
+    def record(self,method_name,bytes_written,bytes_read,serialize_time,wire_time,parse_time):
+        latency = serialize_time + wire_time + parse_time
+        latency_bucket = int(latency*1e6).bit_length()
+        with self._lock:
+            method_metrics = self._get_method_metrics(method_name)
+            method_metrics['calls'] += 1
+            method_metrics['bytes_written'] += bytes_written
+            method_metrics['bytes_read'] += bytes_read
+            method_metrics['serialize_time'] += serialize_time
+            method_metrics['wire_time'] += wire_time
+            method_metrics['parse_time'] += parse_time
+            method_metrics['latency_histogram'][latency_bucket] += 1
+
+    def record_error(self,method_name,bytes_written,response):
+        with self._lock:
+            method_metrics = self._get_method_metrics(method_name)
+            method_metrics['calls'] += 1
+            method_metrics['errors'] += 1
+            method_metrics['bytes_written'] += bytes_written
+            if response:
+                method_metrics['bytes_read'] += len(response)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for method_name,method_metrics in self._method_metrics.items():
+                method_snapshot = dict(method_metrics)
+                method_snapshot['latency_histogram'] = dict([((2**latency_bucket)*1e-6,count) for (latency_bucket,count) in sorted(method_metrics['latency_histogram'].items())])
+                snapshot[method_name] = method_snapshot
+        return snapshot
+
+class _FairLock(object):
+    '''
+    Reentrant lock granted to waiting threads in the order they called acquire.
+    The lock is owned by the acquiring thread unless another owner is given,
+    like an event loop client that acquires it from executor threads.
+    '''
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving_ticket = 0
+        self._abandoned_tickets = set()
+        self._owner = None
+        self._depth = 0
+
+    def acquire(self,timeout=None,owner=None):
+        if owner is None:
+            owner = threading.get_ident()
+        with self._condition:
+            if self._owner == owner:
+                self._depth += 1
+                return True
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            acquired = self._condition.wait_for(lambda: (self._serving_ticket == ticket) and (self._owner is None),timeout)
+            if not acquired:
+                self._abandoned_tickets.add(ticket)
+                self._skip_abandoned_tickets()
+                return False
+            self._owner = owner
+            self._depth = 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._serving_ticket += 1
+                self._skip_abandoned_tickets()
+
+    def _skip_abandoned_tickets(self):
+        while self._serving_ticket in self._abandoned_tickets:
+            self._abandoned_tickets.remove(self._serving_ticket)
+            self._serving_ticket += 1
+        self._condition.notify_all()
+
+class _RingBuffer(object):
+    '''
+    Fixed size buffer of timestamped samples that overwrites the oldest samples
+    when full. Storage is preallocated, timestamps in an array.array and
+    values in a list, or in a numpy array when dtype is given.
+    '''
+    def __init__(self,size,dtype=None):
+        self._size = size
+        self._timestamps = array.array('d',bytes(8*size))
+        if dtype is None:
+            self._values = [None]*size
+        else:
+            import numpy
+            self._values = numpy.zeros(size,dtype=dtype)
+        self._dtype = dtype
+        self._start = 0
+        self._count = 0
+        self._closed = False
+        self.overruns = 0
+        self._condition = threading.Condition()
+
+    def append(self,timestamp,value):
+        with self._condition:
+            index = (self._start + self._count) % self._size
+            self._timestamps[index] = timestamp
+            self._values[index] = value
+            if self._count == self._size:
+                self._start = (self._start + 1) % self._size
+                self.overruns += 1
+            else:
+                self._count += 1
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def is_closed(self):
+        with self._condition:
+            return self._closed and (self._count == 0)
+
+    def read(self,max_count=None,timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: (self._count > 0) or self._closed,timeout)
+            count = self._count
+            if max_count is not None:
+                count = min(count,max_count)
+            indexes = [(self._start + offset) % self._size for offset in range(count)]
+            timestamps = array.array('d',[self._timestamps[index] for index in indexes])
+            if self._dtype is None:
+                values = [self._values[index] for index in indexes]
+            else:
+                values = self._values[indexes]
+            self._start = (self._start + count) % self._size
+            self._count -= count
+        return timestamps,values
+
+class _ModularMethod(object):
+    '''
+    Modular method bound to a ModularClient. The request bytes that do not
+    depend on the call arguments are encoded once, so each call only encodes
+    its arguments. Keyword arguments, or a single dict argument, are mapped to
+    positions by parameter name. The docstring is requested from the device the first time
+    it is read, unless it was set when the method was created.
+    '''
+    def __init__(self,client,method_name,method_id):
+        self.__name__ = method_name
+        self._client = client
+        self._docstring = None
+        self._set_method_id(method_id)
+
+    def _set_method_id(self,method_id):
+        self._method_id = method_id
+        encoded_method_id = _encode_json(method_id)
+        self._request_without_args = '[{0}]\n'.format(encoded_method_id).encode()
+        self._request_prefix = '[{0},'.format(encoded_method_id).encode()
+
+    @property
+    def __doc__(self):
+        if self._docstring is None:
+            self._docstring = self._client._create_method_docstring(self.__name__,self._method_id)
+        return self._docstring
+
+    def _encode_request(self,args):
+        if not args:
+            return self._request_without_args
+        # the arguments encode as a json array, so drop its opening bracket
+        return self._request_prefix + _encode_json_bytes(args)[1:] + b'\n'
+
+    def __call__(self,*args,**kwargs):
+        client = self._client
+        if kwargs:
+            args = client._args_to_list(self.__name__,self._method_id,args,kwargs)
+        elif (len(args) == 1) and (type(args[0]) is dict):
+            args = client._args_to_list(self.__name__,self._method_id,(),args[0])
+        if client._unique_ids:
+            try:
+                return client._send_request_by_method_id(self._method_id,*args)
+            except Exception as e:
+                client._raise_with_context(e)
+        if client._metrics is not None:
+            time_start = timer()
+        else:
+            time_start = None
+        request = self._encode_request(args)
+        try:
+            return client._send_request(request,self._method_id,self._method_id,time_start)
+        except Exception as e:
+            client._raise_with_context(e)
+
 class ModularClients(dict):
     '''ModularClients inherits from dict and automatically populates it with
     modular clients on all available serial ports. Access each individual client
@@ -374,6 +1758,8 @@ class ModularClients(dict):
     devs = ModularClients(use_ports='(/dev/tty\.usbmodem26247)[1-2]') # Mac OS X RE Alternative
     devs = ModularClients(use_ports=['COM3','COM4']) # Windows
     devs = ModularClients(use_ports='(COM)[3-4]') # Windows RE Alternative
+    # Remember which device is on which usb port to speed up later searches:
+    devs = ModularClients(use_registry=True)
     devs.items()
     # dev = devs[name][form_factor][serial_number]
     devs = ModularClients(use_ports='(/dev/ttyACM)[0-1]',keys=[0,1])
@@ -382,28 +1768,63 @@ class ModularClients(dict):
     dev = devs['device0']
     devs = ModularClients(use_ports='(/dev/ttyACM)[0-1]',ports_as_keys=True)
     dev = devs['/dev/ttyACM0']
+    # Clients are constructed concurrently. Ports that fail are skipped with a
+    # warning instead of aborting the whole set.
+    devs.get_port_errors()
+    # Call a method on every device concurrently, results are keyed like devs:
+    devs.call_all('get_device_info')
+    # Construct every client from the same saved api:
+    devs = ModularClients(api='api')
+    # Run the clients in worker processes, each owning a subset of the ports,
+    # so parsing and post processing results scale with cores. postprocess
+    # runs in the worker that owns the device and must be picklable:
+    devs = ModularClients(processes=4)
+    devs.call_all('get_device_info',postprocess=summarize)
+    devs.close()
+    # Save the device id, device info and api of every device concurrently,
+    # writing each distinct firmware api once:
+    devs.save_all('fleet')
+    # Each device later loads the saved api of the firmware version it runs:
+    devs = ModularClients(api='fleet/apis')
     '''
     def __init__(self,*args,**kwargs):
         if 'key_port_debug' in kwargs:
             self.key_port_debug = kwargs.pop('key_port_debug')
         else:
             self.key_port_debug = False
+        if isinstance(kwargs.get('api'),str):
+            # parse the saved api once and share it with every client
+            kwargs['api'] = _load_api(kwargs['api'])
+        if 'processes' in kwargs:
+            processes = kwargs.pop('processes')
+        else:
+            processes = None
+        find_kwargs = {}
+        if 'max_workers' in kwargs:
+            find_kwargs['max_workers'] = kwargs.pop('max_workers')
+        if 'port_timeout' in kwargs:
+            find_kwargs['port_timeout'] = kwargs.pop('port_timeout')
+        if 'full_probe' in kwargs:
+            find_kwargs['full_probe'] = kwargs.pop('full_probe')
         try:
             modular_device_ports = kwargs.pop('use_ports')
             if modular_device_ports is None:
                 raise KeyError
             if isinstance(modular_device_ports,str):
+                import sre_yield
                 modular_device_ports = list(sre_yield.AllStrings(modular_device_ports))
             if len(modular_device_ports) != len(set(modular_device_ports)):
                 raise KeyError
         except KeyError:
-            modular_device_ports = find_modular_device_ports(*args,**kwargs)
+            find_kwargs.update(kwargs)
+            modular_device_ports = find_modular_device_ports(*args,**find_kwargs)
 
         try:
             keys = kwargs.pop('keys')
             if keys is None:
                 raise KeyError
             if isinstance(keys,str):
+                import sre_yield
                 keys = list(sre_yield.AllStrings(keys))
             if len(keys) != len(modular_device_ports):
                 raise KeyError
@@ -419,18 +1840,242 @@ class ModularClients(dict):
         except KeyError:
             ports_as_keys = False
 
+        self._client_processes = []
+        if processes:
+            devs = self._create_devices_in_processes(modular_device_ports,processes,find_kwargs.get('max_workers'),*args,**kwargs)
+        else:
+            devs = self._create_devices(modular_device_ports,find_kwargs.get('max_workers'),*args,**kwargs)
         for key,port in zip(keys,modular_device_ports):
-            self._add_device(key,port,ports_as_keys,*args,**kwargs)
+            if port in devs:
+                self._add_device(key,port,devs[port],ports_as_keys)
+        if self._port_errors:
+            warning_message = 'Unable to create modular clients on ports:\n'
+            for port,error in sorted(self._port_errors.items()):
+                warning_message += '{0}: {1}\n'.format(port,error)
+            warnings.warn(warning_message,RuntimeWarning)
 
     def _key_port_debug_print(self,key,port):
         if self.key_port_debug:
             print('key={0}, port={1}'.format(key,port))
 
-    def _add_device(self,key,port,ports_as_keys,*args,**kwargs):
-        kwargs.update({'port': port})
-        dev = ModularClient(*args,**kwargs)
+    def _create_devices(self,ports,max_workers,*args,**kwargs):
+        '''
+        Constructs a ModularClient on every port concurrently. Returns a dict of
+        clients by port and stores the exception raised on each failed port in
+        self._port_errors.
+        '''
+        devs,self._port_errors = _create_clients(ports,max_workers,args,kwargs)
+        return devs
+
+    def _create_devices_in_processes(self,ports,processes,max_workers,*args,**kwargs):
+        '''
+        Starts up to processes worker processes, each constructing the clients
+        on its share of the ports. Returns a dict of proxies for the clients by
+        port and stores the exception raised on each failed port in
+        self._port_errors.
+        '''
+        import multiprocessing
+        context = multiprocessing.get_context()
+        # discovery returns the ports as the keys of a dict
+        ports = list(ports)
+        processes = min(processes,len(ports))
+        for process_index in range(processes):
+            self._client_processes.append(_ClientProcess(context,ports[process_index::processes],max_workers,args,kwargs))
+        devs = {}
+        self._port_errors = {}
+        # the workers construct their clients at the same time
+        for client_process in self._client_processes:
+            client_infos,port_errors = client_process.wait_until_ready()
+            for port,(device_id,method_names) in client_infos.items():
+                devs[port] = _ModularClientProxy(client_process,port,device_id,method_names)
+            self._port_errors.update(port_errors)
+        return devs
+
+    def _iter_clients(self,clients=None,key_path=()):
+        '''
+        Yields a tuple of the keys leading to each client along with the client.
+        '''
+        if clients is None:
+            clients = self
+        for key,value in clients.items():
+            if isinstance(value,dict):
+                for item in self._iter_clients(value,key_path + (key,)):
+                    yield item
+            else:
+                yield key_path + (key,),value
+
+    def call_all(self,method_name,*args,args_map=None,select=None,max_workers=None,return_exceptions=False,postprocess=None):
+        '''
+        Calls method_name concurrently on every client, or on the clients for
+        which select(key_path,dev) returns True, and returns the results keyed
+        the same way as the collection. A key_path is the tuple of keys leading
+        to a client, like (name,form_factor,serial_number). args_map optionally
+        maps key paths to per-client argument tuples that replace args. When
+        postprocess is given, each result is replaced by postprocess(result),
+        computed in the worker process that owns the client when constructed
+        with processes. The first error is raised after all calls finish,
+        unless return_exceptions is True, in which case errors are returned in
+        place of results.
+        '''
+        calls = []
+        for key_path,dev in self._iter_clients():
+            if (select is not None) and (not select(key_path,dev)):
+                continue
+            dev_args = args
+            if args_map is not None:
+                if key_path in args_map:
+                    dev_args = args_map[key_path]
+                elif (len(key_path) == 1) and (key_path[0] in args_map):
+                    dev_args = args_map[key_path[0]]
+            calls.append((key_path,dev,dev_args))
+        results = {}
+        if len(calls) == 0:
+            return results
+        if max_workers is None:
+            max_workers = len(calls)
+        def call_dev(dev,dev_args):
+            result = getattr(dev,method_name)(*dev_args)
+            if postprocess is not None:
+                result = postprocess(result)
+            return result
+        futures = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers,1)) as executor:
+            for key_path,dev,dev_args in calls:
+                if isinstance(dev,_ModularClientProxy):
+                    # the worker process calls its clients concurrently itself
+                    futures.append((key_path,dev.call_async(method_name,*dev_args,postprocess=postprocess)))
+                else:
+                    futures.append((key_path,executor.submit(call_dev,dev,dev_args)))
+        errors = []
+        for key_path,future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(e)
+                result = e
+            self._set_nested(results,key_path,result)
+        if errors and (not return_exceptions):
+            raise errors[0]
+        return results
+
+    def _set_nested(self,results,key_path,value):
+        level = results
+        for key in key_path[:-1]:
+            level = level.setdefault(key,{})
+        level[key_path[-1]] = value
+
+    def get_metrics(self):
+        '''
+        Get a snapshot of the metrics of every client keyed the same way as the
+        collection. Clients must be constructed with metrics=True.
+        '''
+        metrics = {}
+        for key_path,dev in self._iter_clients():
+            self._set_nested(metrics,key_path,dev.get_metrics())
+        return metrics
+
+    def reset_metrics(self):
+        '''
+        Clear the recorded metrics of every client.
+        '''
+        for key_path,dev in self._iter_clients():
+            dev.reset_metrics()
+
+    def get_port_errors(self):
+        '''
+        Get a dict of the exceptions raised by ports that could not be added.
+        '''
+        return dict(self._port_errors)
+
+    def save_all(self,output_directory=None,verbosity='DETAILED',firmware='ALL',max_workers=None):
+        '''
+        Saves the device id, device info and api of every client, collected
+        from all devices concurrently. Each line of devices.jsonl in
+        output_directory describes one device and is written as soon as that
+        device finishes. Apis are saved in the apis subdirectory in the
+        save_api format, named by firmware and content hash, so an api shared
+        by many devices is written once along with every firmware version
+        that serves it. Returns a dict of the errors of the devices that could
+        not be saved, keyed by key path.
+        '''
+        if output_directory is None:
+            output_directory = os.path.join(os.path.curdir,'modular_devices')
+        api_directory = os.path.join(output_directory,'apis')
+        if not os.path.exists(api_directory):
+            os.makedirs(api_directory)
+        saved_api_versions = {}
+        saved_api_versions_lock = threading.Lock()
+        def save_api(firmware_info,api):
+            api_json = json.dumps(api,sort_keys=True,separators=(',',':'))
+            api_hash = hashlib.sha256(api_json.encode('utf-8')).hexdigest()
+            api_filename = '{0}_{1}.json'.format(firmware_info['name'],api_hash[:16])
+            api_path = os.path.join(api_directory,api_filename)
+            firmware_version = firmware_info.get('version')
+            with saved_api_versions_lock:
+                versions = saved_api_versions.get(api_path)
+                if versions is None:
+                    # keep the versions recorded by an earlier save
+                    versions = _load_saved_api_versions(api_path)
+                    saved_api_versions[api_path] = versions
+                if firmware_version not in versions:
+                    # firmware versions with identical apis share the file,
+                    # which records all of them
+                    versions.append(firmware_version)
+                    saved = {'id': 'getApi',
+                             'firmware': {'name': firmware_info['name'],'versions': versions},
+                             'result': api}
+                    with tempfile.NamedTemporaryFile('w',dir=api_directory,suffix='.tmp',delete=False) as api_file:
+                        json.dump(saved,api_file,separators=(',',':'))
+                    os.replace(api_file.name,api_path)
+            return os.path.join('apis',api_filename)
+        def save_device(key_path,dev):
+            device_info = dev.call_get_result('getDeviceInfo')
+            firmware_infos = [firmware_info for firmware_info in device_info['firmware'] if (firmware == 'ALL') or (firmware == firmware_info['name'])]
+            # request every api back to back instead of one round trip each
+            apis = dev.call_many([('get_api',verbosity,[firmware_info['name']]) for firmware_info in firmware_infos])
+            api_paths = {}
+            for firmware_info,api in zip(firmware_infos,apis):
+                api_paths[firmware_info['name']] = save_api(firmware_info,api)
+            return {'key_path': list(key_path),
+                    'port': dev.get_port(),
+                    'device_id': dev._device_id,
+                    'device_info': device_info,
+                    'apis': api_paths}
+        clients = list(self._iter_clients())
+        errors = {}
+        if len(clients) == 0:
+            return errors
+        if max_workers is None:
+            max_workers = len(clients)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers,1)) as executor:
+            futures = dict((executor.submit(save_device,key_path,dev),key_path) for key_path,dev in clients)
+            with open(os.path.join(output_directory,'devices.jsonl'),'w') as devices_file:
+                for future in concurrent.futures.as_completed(futures):
+                    key_path = futures[future]
+                    try:
+                        device = future.result()
+                    except Exception as e:
+                        errors[key_path] = e
+                        continue
+                    devices_file.write(json.dumps(device,separators=(',',':')) + '\n')
+                    devices_file.flush()
+        return errors
+
+    def close(self):
+        '''
+        Close the serial ports of every client and stop the worker processes.
+        '''
+        for key_path,dev in self._iter_clients():
+            if not isinstance(dev,_ModularClientProxy):
+                dev.close()
+        for client_process in self._client_processes:
+            client_process.close()
+        self._client_processes = []
+
+    def _add_device(self,key,port,dev,ports_as_keys):
         if (key is None) and (not ports_as_keys):
-            device_id = dev.get_device_id()
+            # the device id was already requested during construction
+            device_id = dev._device_id
             name = device_id['name']
             form_factor = device_id['form_factor']
             serial_number = device_id['serial_number']
@@ -448,14 +2093,397 @@ class ModularClients(dict):
             self[key] = dev
             self._key_port_debug_print(key,port)
 
+def _create_clients(ports,max_workers,args,kwargs):
+    '''
+    Constructs a ModularClient on every port concurrently. Returns a dict of
+    clients by port and a dict of the exception raised on each failed port.
+    '''
+    devs = {}
+    port_errors = {}
+    if len(ports) == 0:
+        return devs,port_errors
+    if max_workers is None:
+        max_workers = len(ports)
+    def create_device(port):
+        port_kwargs = dict(kwargs)
+        port_kwargs.update({'port': port})
+        return ModularClient(*args,**port_kwargs)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers,1)) as executor:
+        futures = dict((executor.submit(create_device,port),port) for port in ports)
+        for future in concurrent.futures.as_completed(futures):
+            port = futures[future]
+            try:
+                devs[port] = future.result()
+            except Exception as e:
+                port_errors[port] = e
+    return devs,port_errors
+
+def _serve_clients(connection,ports,max_workers,args,kwargs):
+    '''
+    Runs in a worker process of ModularClients. Constructs the clients on
+    ports, reports their device ids and methods, then calls their methods for
+    each message received until None is received. Calls run concurrently on
+    a thread per client, each call is answered with a message holding its
+    call id, whether it succeeded and its result or error.
+    '''
+    devs,port_errors = _create_clients(ports,max_workers,args,kwargs)
+    client_infos = dict([(port,(dev._device_id,dev.get_methods())) for (port,dev) in devs.items()])
+    connection.send((client_infos,port_errors))
+    send_lock = threading.Lock()
+    def call(call_id,port,method_name,call_args,call_kwargs,postprocess):
+        try:
+            result = getattr(devs[port],method_name)(*call_args,**call_kwargs)
+            if postprocess is not None:
+                result = postprocess(result)
+            reply = (call_id,True,result)
+        except Exception as e:
+            reply = (call_id,False,e)
+        with send_lock:
+            try:
+                connection.send(reply)
+            except Exception as e:
+                # results or errors that can not be pickled
+                connection.send((call_id,False,RuntimeError('Unable to send reply: {0!r}'.format(e))))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(devs),1)) as executor:
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                break
+            if message is None:
+                break
+            executor.submit(call,*message)
+    for dev in devs.values():
+        dev.close()
+    connection.close()
+
+class _ClientProcess(object):
+    '''
+    Worker process that owns the clients on a subset of ports. Calls are sent
+    to it as small pickled messages over a pipe and a thread hands each reply
+    to the future waiting for it.
+    '''
+    def __init__(self,context,ports,max_workers,args,kwargs):
+        self._connection,child_connection = context.Pipe()
+        self._process = context.Process(target=_serve_clients,
+                                        args=(child_connection,ports,max_workers,args,kwargs),
+                                        daemon=True)
+        self._process.start()
+        child_connection.close()
+        self._send_lock = threading.Lock()
+        self._call_ids = itertools.count()
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._reply_reader_thread = None
+
+    def wait_until_ready(self):
+        '''
+        Returns the device ids and methods of the clients the worker
+        constructed, by port, and the errors of the ports that failed.
+        '''
+        try:
+            client_infos,port_errors = self._connection.recv()
+        except EOFError:
+            raise RuntimeError('Client process exited with code {0}'.format(self._process.exitcode))
+        self._reply_reader_thread = threading.Thread(target=self._read_replies,daemon=True)
+        self._reply_reader_thread.start()
+        return client_infos,port_errors
+
+    def submit(self,port,method_name,args,kwargs,postprocess):
+        future = concurrent.futures.Future()
+        call_id = next(self._call_ids)
+        with self._futures_lock:
+            self._futures[call_id] = future
+        try:
+            with self._send_lock:
+                self._connection.send((call_id,port,method_name,args,kwargs,postprocess))
+        except Exception:
+            with self._futures_lock:
+                self._futures.pop(call_id,None)
+            raise
+        return future
+
+    def _read_replies(self):
+        while True:
+            try:
+                call_id,succeeded,result = self._connection.recv()
+            except (EOFError,OSError):
+                break
+            with self._futures_lock:
+                future = self._futures.pop(call_id)
+            if succeeded:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        with self._futures_lock:
+            futures = list(self._futures.values())
+            self._futures.clear()
+        for future in futures:
+            future.set_exception(IOError('Client process exited.'))
+
+    def close(self):
+        try:
+            with self._send_lock:
+                self._connection.send(None)
+        except (OSError,ValueError):
+            pass
+        self._process.join()
+        if self._reply_reader_thread is not None:
+            self._reply_reader_thread.join()
+        self._connection.close()
+
+class _ModularClientProxy(object):
+    '''
+    Stands in for a ModularClient owned by a worker process. Calling any of
+    its methods calls the method of the same name in the worker and returns
+    the result.
+    '''
+    def __init__(self,client_process,port,device_id,method_names):
+        self._client_process = client_process
+        self._port = port
+        self._device_id = device_id
+        self._method_names = method_names
+
+    def get_port(self):
+        return self._port
+
+    def get_methods(self):
+        return list(self._method_names)
+
+    def call_async(self,method_name,*args,postprocess=None,**kwargs):
+        '''
+        Calls method_name in the worker process and returns a future for its
+        result, or for postprocess(result) computed in the worker.
+        '''
+        return self._client_process.submit(self._port,method_name,args,kwargs,postprocess)
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError('{0} object has no attribute {1}'.format(type(self).__name__,name))
+        def method_func(*args,**kwargs):
+            return self.call_async(name,*args,**kwargs).result()
+        method_func.__name__ = name
+        return method_func
+
+    def __dir__(self):
+        names = set(super(_ModularClientProxy,self).__dir__())
+        names.update(self._method_names)
+        return sorted(names)
+
+def get_cache_dir():
+    '''
+    Returns the user cache directory used to store method tables and docstrings
+    of previously seen firmware.
+    '''
+    os_type = platform.system()
+    if os_type == 'Windows':
+        base_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif os_type == 'Darwin':
+        base_dir = os.path.expanduser(os.path.join('~','Library','Caches'))
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~','.cache'))
+    return os.path.join(base_dir,'modular_client')
+
+def clear_cache(cache_dir=None):
+    '''
+    Remove all cached method tables and docstrings and the device registry.
+    '''
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    shutil.rmtree(cache_dir,ignore_errors=True)
+
+def _load_api(api_path):
+    '''
+    Loads the getApi results saved by ModularClient.save_api or
+    ModularClients.save_all from a json file or a directory of json files.
+    Returns a dict with a list of the saved apis, each with the firmware
+    versions it serves by firmware name, None where the versions were not
+    saved, and the method help by method name, None where only the name was
+    saved.
+    '''
+    if os.path.isdir(api_path):
+        api_paths = [os.path.join(api_path,filename) for filename in sorted(os.listdir(api_path)) if filename.endswith('.json')]
+    else:
+        api_paths = [api_path]
+    apis = []
+    device_info = None
+    for path in api_paths:
+        with open(path,'r') as api_file:
+            saved = json.load(api_file)
+        if not isinstance(saved,dict):
+            continue
+        if saved.get('id') == 'getDeviceInfo':
+            # saved by save_device_info next to the api files
+            device_info = saved['result']
+            continue
+        if saved.get('id') != 'getApi':
+            continue
+        result = saved['result']
+        firmware = dict([(firmware_name,None) for firmware_name in result['firmware']])
+        if 'firmware' in saved:
+            firmware[saved['firmware']['name']] = _get_saved_api_versions(saved['firmware'])
+        methods = {}
+        for method_type in ['functions','properties','callbacks']:
+            for method in result.get(method_type,[]):
+                if isinstance(method,dict):
+                    methods[method['name']] = method
+                else:
+                    methods.setdefault(method,None)
+        apis.append({'firmware': firmware,'methods': methods})
+    if device_info is not None:
+        for firmware_info in device_info['firmware']:
+            for api in apis:
+                if (firmware_info['name'] in api['firmware']) and (api['firmware'][firmware_info['name']] is None):
+                    api['firmware'][firmware_info['name']] = _get_saved_api_versions(firmware_info)
+    if not any([len(api['methods']) > 0 for api in apis]):
+        raise ValueError('No saved getApi results found in {0}'.format(api_path))
+    return {'apis': apis}
+
+def _get_saved_api_versions(firmware_info):
+    '''
+    Returns the list of firmware versions recorded with a saved api, or None
+    if any version is accepted.
+    '''
+    if 'versions' in firmware_info:
+        versions = firmware_info['versions']
+    else:
+        versions = [firmware_info.get('version')]
+    if None in versions:
+        return None
+    return list(versions)
+
+def _load_saved_api_versions(api_path):
+    try:
+        with open(api_path,'r') as api_file:
+            return list(json.load(api_file)['firmware']['versions'])
+    except (IOError,ValueError,KeyError,TypeError):
+        return []
+
+def _merge_api_methods(methods,api_methods):
+    for method_id, method_help in api_methods.items():
+        if method_help is not None:
+            methods[method_id] = method_help
+        else:
+            methods.setdefault(method_id,None)
+
+def _select_api_methods(api,device_firmware):
+    '''
+    Returns the methods of the saved apis that serve the firmware versions in
+    device_firmware, a dict of versions by firmware name, or None if a
+    firmware running on the device has saved apis but none for its version.
+    '''
+    methods = {}
+    api_firmware_names = set()
+    matched_firmware_names = set()
+    for saved_api in api['apis']:
+        api_firmware_names.update(saved_api['firmware'].keys())
+        matches = True
+        for firmware_name, versions in saved_api['firmware'].items():
+            if firmware_name not in device_firmware:
+                matches = False
+            elif (versions is not None) and (device_firmware[firmware_name] not in versions):
+                matches = False
+        if matches:
+            matched_firmware_names.update(saved_api['firmware'].keys())
+            _merge_api_methods(methods,saved_api['methods'])
+    if (len(matched_firmware_names) == 0) or (not matched_firmware_names.issuperset(api_firmware_names.intersection(device_firmware.keys()))):
+        return None
+    return methods
+
+def save_api_stub(api_path,output_path=None,class_name='ModularDevice'):
+    '''
+    Writes a python stub file declaring a ModularClient subclass with the
+    methods, parameters and docstrings of an api saved by
+    ModularClient.save_api, so IDEs and type checkers can complete them.
+    Returns the stub file path.
+    '''
+    api = _load_api(api_path)
+    firmware_names = [firmware_name for saved_api in api['apis'] for firmware_name in saved_api['firmware'].keys()]
+    for firmware_name in set(firmware_names):
+        if firmware_names.count(firmware_name) > 1:
+            raise ValueError('{0} has apis of several versions of firmware {1}, pass one of its files instead'.format(api_path,firmware_name))
+    methods = {}
+    for saved_api in api['apis']:
+        _merge_api_methods(methods,saved_api['methods'])
+    if output_path is None:
+        output_path = os.path.join(os.path.curdir,_underscore(class_name) + '.pyi')
+    lines = ['# Generated by modular_client.save_api_stub from {0}'.format(api_path),
+             'from typing import Any',
+             'from modular_client import ModularClient',
+             '',
+             '',
+             'class {0}(ModularClient):'.format(class_name)]
+    for method_id, method_help in sorted(methods.items()):
+        method_name = _underscore(method_id)
+        if (not method_name.isidentifier()) or keyword.iskeyword(method_name):
+            continue
+        parameters = None
+        try:
+            parameters = [parameter['name'] if isinstance(parameter,dict) else parameter for parameter in method_help['parameters']]
+            parameters = [_underscore(parameter) for parameter in parameters]
+        except (KeyError,TypeError):
+            parameters = None
+        if (parameters is None) or any([(not parameter.isidentifier()) or keyword.iskeyword(parameter) for parameter in parameters]):
+            signature = 'self, *args: Any, **kwargs: Any'
+        else:
+            signature = ', '.join(['self'] + [parameter + ': Any' for parameter in parameters])
+        lines.append('    def {0}({1}) -> Any:'.format(method_name,signature))
+        if method_help is not None:
+            lines.append('        {0}'.format(repr(str(method_help))))
+        lines.append('        ...')
+    output_directory = os.path.dirname(output_path)
+    if output_directory and (not os.path.exists(output_directory)):
+        os.makedirs(output_directory)
+    with open(output_path,'w') as stub_file:
+        stub_file.write('\n'.join(lines) + '\n')
+    return output_path
+
 def check_dict_for_key(d,k,dname=''):
     if not k in d:
         if not dname:
             dname = 'dictionary'
         raise IOError('{0} does not contain {1}'.format(dname,k))
 
+def response_to_result(response,request_id):
+    '''
+    Parses a server response, or takes an already parsed response dict, and
+    returns its result. Raises ResponseTimeoutError if the response is
+    missing, ProtocolError if it is malformed or does not match request_id
+    and DeviceError if it contains an error from the server, all of which are
+    IOErrors.
+    '''
+    if response is None:
+        raise ResponseTimeoutError(request_id)
+    if isinstance(response,dict):
+        response_dict = response
+    else:
+        try:
+            response_dict = json_string_to_dict(response)
+        except Exception as e:
+            raise ProtocolError('Error:\n{error}\nUnable to parse server response:\n{response}',request_id,response,error=e)
+        if not isinstance(response_dict,dict):
+            raise ProtocolError('Server response is not a json object:\n{response}',request_id,response)
+    try:
+        response_id = response_dict['id']
+    except KeyError:
+        raise ProtocolError('Server response does not contain id member:\n{response}',request_id,response)
+    if not response_id == request_id:
+        raise ProtocolError('Response id:\n{response_id}\nDoes not match request id:\n{request_id}\nin response:{response}',request_id,response,response_id)
+    error = response_dict.get('error')
+    if error is not None:
+        if not isinstance(error,dict):
+            raise ProtocolError('Server response error member is not a json object:\n{response}',request_id,response)
+        raise DeviceError(error.get('code',''),error.get('message',''),error.get('data',''),request_id,response)
+    try:
+        return response_dict['result']
+    except KeyError:
+        raise ProtocolError('Server response does not contain result member:\n{response}',request_id,response)
+
 def json_string_to_dict(json_string):
-    json_dict =  json.loads(json_string,object_hook=json_decode_dict)
+    '''
+    Decodes a json string in a single pass, using orjson when it is installed.
+    '''
+    json_dict = _json_loads(json_string)
     return json_dict
 
 def json_decode_dict(data):
@@ -515,7 +2543,28 @@ def find_modular_device_ports(baudrate=None,
                               try_ports=None,
                               debug=DEBUG,
                               *args,
+                              max_workers=None,
+                              port_timeout=None,
+                              full_probe=False,
+                              use_registry=None,
+                              cache_dir=None,
                               **kwargs):
+    '''
+    Returns a dict of the ports of all matching modular devices along with their
+    device ids. Ports are probed concurrently by up to max_workers threads, so
+    discovery takes roughly as long as the slowest port. Set max_workers=1 to
+    probe ports one after another. Ports that take longer than port_timeout
+    seconds to probe are skipped. Each port is probed with a single getDeviceId
+    request unless full_probe is True, in which case a complete ModularClient is
+    constructed on each port.
+
+    With use_registry=True, the device found on each usb port is remembered
+    in a registry file in the cache directory along with the usb vendor id,
+    product id and serial number of the port. Ports that still have the same
+    usb identity are only probed if their remembered device matches, to
+    verify it, unless no match is found that way. Ports that did not answer
+    their last probe are not remembered.
+    '''
     serial_interface_ports = find_serial_interface_ports(try_ports=try_ports, debug=debug)
     os_type = platform.system()
     if os_type == 'Darwin':
@@ -528,34 +2577,213 @@ def find_modular_device_ports(baudrate=None,
     if type(serial_number) is int:
         serial_number = [serial_number]
 
-    modular_device_ports = {}
-    for port in serial_interface_ports:
-        try:
-            dev = ModularClient(port=port,baudrate=baudrate,debug=debug)
-            device_id = dev.get_device_id()
-            if ((name is None ) and (device_id['name'] is not None)) or (device_id['name'] in name):
-                if ((form_factor is None) and (device_id['form_factor'] is not None)) or (device_id['form_factor'] in form_factor):
-                    if ((serial_number is None) and (device_id['serial_number'] is not None)) or (device_id['serial_number'] in serial_number):
-                        modular_device_ports[port] = {'name': device_id['name'],
-                                                      'form_factor': device_id['form_factor'],
-                                                      'serial_number': device_id['serial_number']}
-            dev.close()
-        except (serial.SerialException, IOError):
-            pass
+    def probe(ports):
+        ports_max_workers = max_workers
+        if ports_max_workers is None:
+            ports_max_workers = min(PORT_PROBE_MAX_WORKERS,len(ports))
+        if (ports_max_workers <= 1) and (port_timeout is None):
+            return [(port,_probe_modular_device_port(port,baudrate,debug,full_probe)) for port in ports]
+        return _probe_modular_device_ports_concurrently(ports,baudrate,debug,full_probe,ports_max_workers,port_timeout)
+
+    def match(device_ids):
+        modular_device_ports = {}
+        for port,device_id in device_ids:
+            if _device_id_matches(device_id,name,form_factor,serial_number):
+                modular_device_ports[port] = {'name': device_id['name'],
+                                              'form_factor': device_id['form_factor'],
+                                              'serial_number': device_id['serial_number']}
+        return modular_device_ports
+
+    if use_registry is None:
+        use_registry = USE_REGISTRY
+    skipped_ports = []
+    if use_registry:
+        registry = _load_device_registry(cache_dir)
+        usb_identities = _get_usb_identities()
+        probe_ports = []
+        for port in serial_interface_ports:
+            record = registry.get(port)
+            # ports without a remembered device, like ones that failed to
+            # answer a probe, are always probed again
+            trusted = (isinstance(record,dict) and (record.get('device_id') is not None) and
+                       (port in usb_identities) and (record.get('usb') == usb_identities[port]))
+            if trusted and (not _device_id_matches(record.get('device_id'),name,form_factor,serial_number)):
+                skipped_ports.append(port)
+            else:
+                probe_ports.append(port)
+    else:
+        probe_ports = serial_interface_ports
+
+    device_ids = probe(probe_ports)
+    modular_device_ports = match(device_ids)
+    if skipped_ports:
+        # the registry missed if it did not lead to every requested device
+        found_serial_numbers = set([device_id['serial_number'] for device_id in modular_device_ports.values()])
+        if (len(modular_device_ports) == 0) or ((serial_number is not None) and (not found_serial_numbers.issuperset(serial_number))):
+            device_ids.extend(probe(skipped_ports))
+            modular_device_ports = match(device_ids)
+
+    if use_registry:
+        for port,device_id in device_ids:
+            if (port in usb_identities) and (device_id is not None):
+                registry[port] = {'usb': usb_identities[port],'device_id': device_id}
+            else:
+                registry.pop(port,None)
+        _save_device_registry(cache_dir,registry)
     return modular_device_ports
 
+def _device_id_matches(device_id,name,form_factor,serial_number):
+    if device_id is None:
+        return False
+    if ((name is None ) and (device_id['name'] is not None)) or (device_id['name'] in name):
+        if ((form_factor is None) and (device_id['form_factor'] is not None)) or (device_id['form_factor'] in form_factor):
+            if ((serial_number is None) and (device_id['serial_number'] is not None)) or (device_id['serial_number'] in serial_number):
+                return True
+    return False
+
+def _get_usb_identities():
+    '''
+    Returns the usb vendor id, product id and serial number of every serial
+    port for which the operating system reports a usb serial number.
+    '''
+    usb_identities = {}
+    try:
+        import serial.tools.list_ports
+        port_infos = serial.tools.list_ports.comports()
+    except Exception:
+        return usb_identities
+    for port_info in port_infos:
+        if getattr(port_info,'serial_number',None) is not None:
+            usb_identities[port_info.device] = [port_info.vid,port_info.pid,port_info.serial_number]
+    return usb_identities
+
+def _get_device_registry_path(cache_dir):
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    return os.path.join(cache_dir,'device_registry.json')
+
+def _load_device_registry(cache_dir):
+    '''
+    Returns the remembered usb identity and device id by port, or an empty
+    dict if there is no readable registry.
+    '''
+    try:
+        with open(_get_device_registry_path(cache_dir),'r') as registry_file:
+            registry = json.load(registry_file)
+    except (OSError,ValueError):
+        return {}
+    if not isinstance(registry,dict):
+        return {}
+    return registry
+
+def _save_device_registry(cache_dir,registry):
+    registry_path = _get_device_registry_path(cache_dir)
+    registry_dir = os.path.dirname(registry_path)
+    try:
+        if not os.path.exists(registry_dir):
+            os.makedirs(registry_dir)
+        with tempfile.NamedTemporaryFile('w',dir=registry_dir,suffix='.tmp',delete=False) as registry_file:
+            json.dump(registry,registry_file,separators=(',',':'))
+        os.replace(registry_file.name,registry_path)
+    except OSError:
+        pass
+
+def _probe_modular_device_port(port,baudrate,debug,full_probe=False):
+    '''
+    Returns the device id of the modular device on port or None if there is no
+    modular device on port. Unless full_probe is True, only a single getDeviceId
+    request is sent instead of constructing a complete ModularClient.
+    '''
+    if full_probe:
+        return _probe_modular_device_port_with_client(port,baudrate,debug)
+    if baudrate is None:
+        baudrate = BAUDRATE
+    # any failure to open the port or to answer the request means there is
+    # no usable modular device on the port
+    try:
+        serial_interface = _create_serial_interface(port=port,
+                                                    baudrate=baudrate,
+                                                    timeout=ModularClient._TIMEOUT,
+                                                    write_read_delay=ModularClient._WRITE_READ_DELAY,
+                                                    write_write_delay=ModularClient._WRITE_WRITE_DELAY,
+                                                    debug=debug)
+    except Exception:
+        return None
+    try:
+        request_id = 'getDeviceId'
+        request = json.dumps([request_id],separators=(',',':')) + '\n'
+        response = serial_interface.write_read(request,use_readline=True,check_write_freq=True)
+        if (type(response) != str):
+            response = response.decode('utf-8')
+        return response_to_result(response,request_id)
+    except Exception:
+        return None
+    finally:
+        serial_interface.close()
+
+def _probe_modular_device_port_with_client(port,baudrate,debug):
+    try:
+        dev = ModularClient(port=port,baudrate=baudrate,debug=debug)
+    except Exception:
+        return None
+    try:
+        return dev.get_device_id()
+    except Exception:
+        return None
+    finally:
+        dev.close()
+
+def _probe_modular_device_ports_concurrently(ports,baudrate,debug,full_probe,max_workers,port_timeout):
+    probe_start_times = {}
+    def probe(port):
+        probe_start_times[port] = time.time()
+        return _probe_modular_device_port(port,baudrate,debug,full_probe)
+    device_ids = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(max_workers,1))
+    try:
+        futures = dict((executor.submit(probe,port),port) for port in ports)
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending,
+                                                    timeout=_PORT_PROBE_POLL_PERIOD,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                device_ids.append((futures[future],future.result()))
+            if port_timeout is not None:
+                time_now = time.time()
+                for future in list(pending):
+                    port = futures[future]
+                    if (port in probe_start_times) and ((time_now - probe_start_times[port]) > port_timeout):
+                        pending.discard(future)
+                        device_ids.append((port,None))
+    finally:
+        for future in futures:
+            future.cancel()
+        # probes that exceeded port_timeout are abandoned rather than waited on
+        executor.shutdown(wait=False)
+    device_ids.sort()
+    return device_ids
+
 def find_modular_device_port(baudrate=None,
                              name=None,
                              form_factor=None,
                              serial_number=None,
                              try_ports=None,
-                             debug=DEBUG):
+                             debug=DEBUG,
+                             max_workers=None,
+                             port_timeout=None,
+                             use_registry=None,
+                             cache_dir=None):
     modular_device_ports = find_modular_device_ports(baudrate=baudrate,
                                                      name=name,
                                                      form_factor=form_factor,
                                                      serial_number=serial_number,
                                                      try_ports=try_ports,
-                                                     debug=debug)
+                                                     debug=debug,
+                                                     max_workers=max_workers,
+                                                     port_timeout=port_timeout,
+                                                     use_registry=use_registry,
+                                                     cache_dir=cache_dir)
     if len(modular_device_ports) == 1:
         return list(modular_device_ports.keys())[0]
     elif len(modular_device_ports) == 0:
@@ -38,8 +38,12 @@ setuptools.setup(
 
     packages=setuptools.find_packages(exclude=['contrib', 'docs', 'tests*']),
 
-    install_requires=['serial_interface',
+    install_requires=['serial_interface>=2.3.1,<2.4',
                       'inflection',
                       'sre_yield',
     ],
+
+    extras_require={
+        'fast': ['orjson'],
+    },
 )
@@ -0,0 +1,69 @@
+'''
+Regression tests for sharing one device between AsyncModularClient coroutines
+and threads that use the wrapped ModularClient directly.
+
+Usage:
+
+python -m pytest tests
+'''
+import asyncio
+
+from modular_client import AsyncModularClient
+from benchmarks.fake_modular_device import FakeModularDevice
+
+
+REQUEST_COUNT = 20
+
+def run_with_fake_device(test,**kwargs):
+    fake_dev = FakeModularDevice(method_count=3,processing_delay=0.001)
+    try:
+        async def main():
+            dev = await AsyncModularClient.create(port=fake_dev.port,use_cache=False,**kwargs)
+            try:
+                await test(dev)
+            finally:
+                dev.close()
+        asyncio.run(main())
+    finally:
+        fake_dev.close()
+
+def test_sync_and_async_requests_take_turns():
+    async def test(dev):
+        loop = asyncio.get_running_loop()
+        def get_device_ids():
+            return [dev._client.get_device_id() for request_index in range(REQUEST_COUNT)]
+        device_ids_future = loop.run_in_executor(None,get_device_ids)
+        echoes = await asyncio.gather(*[dev.echo(data=index) for index in range(REQUEST_COUNT)])
+        device_ids = await device_ids_future
+        assert echoes == list(range(REQUEST_COUNT))
+        assert all(device_id['name'] == 'fake_device' for device_id in device_ids)
+    run_with_fake_device(test)
+
+def test_lazy_keyword_requests_take_turns():
+    async def test(dev):
+        results = await asyncio.gather(*([dev.add(a=index,b=1) for index in range(REQUEST_COUNT)] +
+                                         [dev.echo(data=index) for index in range(REQUEST_COUNT)]))
+        assert results == [index + 1 for index in range(REQUEST_COUNT)] + list(range(REQUEST_COUNT))
+    run_with_fake_device(test,lazy=True)
+
+def test_requests_follow_reconnected_serial_port(tmp_path):
+    fake_dev = FakeModularDevice(method_count=3)
+    try:
+        async def main():
+            # hold a lower file descriptor while the port opens, so the port
+            # opens on another one when it is reconnected
+            placeholder_file = open(str(tmp_path / 'placeholder'),'w')
+            dev = await AsyncModularClient.create(port=fake_dev.port,use_cache=False)
+            placeholder_file.close()
+            try:
+                assert await dev.echo(data=1) == 1
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None,dev._client.reconnect)
+                # take the file descriptor the previous serial port released
+                with open(str(tmp_path / 'unrelated'),'w'):
+                    assert await dev.echo(data=2) == 2
+            finally:
+                dev.close()
+        asyncio.run(main())
+    finally:
+        fake_dev.close()
@@ -0,0 +1,60 @@
+'''
+Tests of ModularClient against a FakeModularDevice.
+
+Usage:
+
+python -m pytest tests
+'''
+import pytest
+
+from modular_client import ModularClient, ProtocolError
+from modular_client.modular_client import response_to_result
+from benchmarks.fake_modular_device import FakeModularDevice
+
+
+READ_TIMEOUT = 2.0
+
+@pytest.fixture
+def fake_dev():
+    fake_dev = FakeModularDevice(method_count=3)
+    yield fake_dev
+    fake_dev.close()
+
+@pytest.mark.parametrize('response',['null','[1,2]','"result"','{"id":1,"error":"failed"}'])
+def test_response_that_is_not_an_object_is_a_protocol_error(response):
+    with pytest.raises(ProtocolError):
+        response_to_result(response,1)
+
+def test_methods_encode_arguments_like_call(fake_dev):
+    numpy = pytest.importorskip('numpy')
+    dev = ModularClient(port=fake_dev.port,use_cache=False)
+    method_id = dev._method_dict['set_value']
+    for args in [('key',numpy.float64(1.5)),('key',{1: 2}),('key',2**70)]:
+        assert dev.set_value._encode_request(args) == dev._args_to_request(method_id,*args).encode()
+        dev.set_value(*args)
+        assert dev.get_value('key') == dev.call_get_result('get_value','key')
+    dev.close()
+
+def read_stream_until_error(dev):
+    with pytest.raises(Exception) as error_info:
+        for timestamps,results in dev.iter_stream(timeout=READ_TIMEOUT):
+            pass
+    assert dev._stream_buffer.is_closed()
+    return error_info.value
+
+def test_stream_stops_when_serial_port_is_lost(fake_dev):
+    dev = ModularClient(port=fake_dev.port,use_cache=False)
+    dev.start_stream('get_device_id',period=0.001)
+    dev.read_stream(max_count=1,timeout=READ_TIMEOUT)
+    dev._serial_interface.close()
+    error = read_stream_until_error(dev)
+    assert dev._stream_error is error
+    dev.stop_stream()
+
+def test_stream_stops_when_result_does_not_fit_dtype(fake_dev):
+    pytest.importorskip('numpy')
+    dev = ModularClient(port=fake_dev.port,use_cache=False)
+    dev.start_stream('get_device_id',dtype=float)
+    read_stream_until_error(dev)
+    dev.stop_stream()
+    dev.close()
@@ -0,0 +1,32 @@
+'''
+Tests of ModularClients constructed from FakeModularDevice ports found by
+discovery.
+
+Usage:
+
+python -m pytest tests
+'''
+import modular_client.modular_client as modular_client_module
+from modular_client import ModularClients
+from benchmarks.fake_modular_device import FakeModularDevice
+
+
+DEVICE_COUNT = 2
+
+def test_processes_with_discovered_ports(monkeypatch):
+    fake_devs = [FakeModularDevice(method_count=3,serial_number=serial_number) for serial_number in range(DEVICE_COUNT)]
+    ports = [fake_dev.port for fake_dev in fake_devs]
+    # pseudo terminals are not listed as serial ports, so hand them to
+    # discovery directly
+    monkeypatch.setattr(modular_client_module,'find_serial_interface_ports',lambda try_ports=None,debug=False: list(ports))
+    try:
+        devs = ModularClients(processes=2,use_cache=False)
+        try:
+            assert sorted(devs['fake_device']['5x3'].keys()) == list(range(DEVICE_COUNT))
+            results = devs.call_all('add',1,2)
+            assert [results['fake_device']['5x3'][serial_number] for serial_number in range(DEVICE_COUNT)] == [3]*DEVICE_COUNT
+        finally:
+            devs.close()
+    finally:
+        for fake_dev in fake_devs:
+            fake_dev.close()